@@ -0,0 +1,261 @@
+import argparse
+import bisect
+import gc
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # peak memory is only reported where resource exists (not on Windows)
+    resource = None
+
+import main
+
+# The Standard Benchmarking Test from the header of main.py, and bigger worlds of the same game
+STANDARD = dict(countries=10, turns=100, games=100, epsilon=0.01, decay_rate=0.99)
+SUITES = {
+    'standard': [('standard', STANDARD)],
+    'scaled': [(f'{countries} countries', dict(STANDARD, countries=countries, games=games))
+               for countries, games in ((20, 10), (50, 2), (100, 1))],
+    'large': [(f'{countries} countries, {turns} turns', dict(STANDARD, countries=countries, turns=turns, games=games))
+              for countries, turns, games in ((10, 100, 5), (1000, 20, 1), (10000, 5, 1))],
+    'array': [(f'{countries} countries (array)', dict(STANDARD, countries=countries, games=games, engine='array'))
+              for countries, games in ((10, 5), (50, 1), (200, 1))],
+    'batch': [(f'batch of {batch}', dict(STANDARD, turns=30, games=256, batch=batch)) for batch in (1, 64, 256)],
+    'evaluate': [('standard training', STANDARD), ('standard evaluation', dict(STANDARD, evaluate=True))],
+    'parallel': [(f'{workers} workers', dict(STANDARD, games=16, workers=workers))
+                 for workers in (1, 2, 4, 8) if workers <= (os.cpu_count() or 1)],
+}
+
+# The last turns of games whose countries start them with these reserves, played with and without the bulk repeats
+# of execute_actions
+LATE_GAME = dict(countries=10, first_turn=80, turns=100, epsilon=0.001, seed=0)
+LATE_GAME_SUITE = [(f'reserve {reserve:.0e}{"" if bulk else " (one pass at a time)"}', dict(LATE_GAME, reserve=reserve, bulk=bulk))
+                   for reserve in (10 ** 6, 10 ** 9, 10 ** 12) for bulk in (True, False)]
+
+# Cost of World.snapshot, restore and fork_world by world size, after a few turns of play from the Q-table on disk
+FORK = dict(turns=10, epsilon=0.01, seed=0)
+FORK_SUITE = [(f'{countries} countries{" (array)" if engine == "array" else ""}', dict(FORK, countries=countries, engine=engine))
+              for engine, sizes in (('object', (10, 100, 1000, 10000)), ('array', (10, 100, 1000))) for countries in sizes]
+
+
+
+# The formulas the lookup tables of main's rules replaced, to time both on the same inputs
+def formula_state(power_level, reserve, connection_count, turn):
+    money_level = min(int(max(0, reserve) ** (1/2) / 5) + 1, main.MAX_MONEY_LEVEL)
+    turn_level = min(turn // main.TURN_LEVEL_TURNS, main.MAX_TURN_LEVEL - 1) + 1
+    return power_level, money_level, connection_count, turn_level
+
+
+def formula_power_level(towns):
+    power_level = 1
+    for level, min_towns in enumerate(main.POWER_LEVELS):
+        if towns >= min_towns:
+            power_level = level + 1
+    return power_level
+
+
+def formula_mine_budget(turn):
+    return min((0.01 * (100 - turn) * 3), 1)
+
+
+def formula_connection_income(size, level):
+    return math.floor(size / max(1, 6 - level))
+
+
+# {rule: (formula, table version, random arguments of one call)}
+RULES = {
+    'discretize_state': (formula_state, main.discretize_state,
+                         lambda rng: (rng.randint(1, 4), float(rng.randint(0, 10 ** rng.randint(1, 12))), rng.randint(0, 5),
+                                      rng.randint(0, 99))),
+    'power level': (formula_power_level, lambda towns: bisect.bisect_right(main.POWER_LEVELS, towns),
+                    lambda rng: (rng.randint(0, 30),)),
+    'mine budget': (formula_mine_budget, main.mine_budget, lambda rng: (rng.randint(0, 99),)),
+    'connection income': (formula_connection_income, lambda size, level: size // main.CONNECTION_DIVISORS[level],
+                          lambda rng: (rng.randint(0, 10 ** 6), rng.randint(1, main.MAX_CONNECTION_LEVEL))),
+}
+RULES_SUITE = [(rule, dict(rule=rule, calls=100_000, seed=0)) for rule in RULES]
+
+
+def peak_memory_kb():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == 'darwin' else peak  # macOS reports bytes, Linux kilobytes
+
+
+class GarbageTimer:
+    # Counts the collections the cyclic garbage collector runs and the time they take
+    def __init__(self):
+        self.collections = 0
+        self.seconds = 0.0
+        self.started = None
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            self.collections += 1
+            self.seconds += time.perf_counter() - self.started
+            self.started = None
+
+
+def run_variant(name, settings, connection):
+    config = main.SimulationConfig(**settings, save=False, verbosity=main.SILENT)
+    garbage = GarbageTimer()
+    gc.callbacks.append(garbage)
+    try:
+        results = main.run_simulation(config)
+    finally:
+        gc.callbacks.remove(garbage)
+    row = {
+        'benchmark': name,
+        **settings,
+        'games_played': results.games_played,
+        'seconds': results.elapsed,
+        'turns_per_second': results.turns_per_second,
+        'games_per_second': results.games_played / results.elapsed if results.elapsed else 0,
+        'phase_seconds': results.phase_times,
+        'peak_memory_kb': peak_memory_kb(),
+        'gc_collections': garbage.collections,
+        'gc_seconds': garbage.seconds,
+        'highest_reserve': results.highest_reserve,
+        'average_reserve': results.average_reserve,
+        'highest_income': results.highest_income,
+    }
+    if results.profile is not None:
+        row['turn_phases'] = results.profile['phases']
+        row['execute_actions_iterations'] = results.profile['execute_actions_iterations']
+        row['execute_actions_passes'] = results.profile['execute_actions_passes']
+    connection.send(row)
+
+
+def run_late_game(name, settings, connection):
+    # Every country gets the reserve, mines and towns of a late game, then the last turns are played with the
+    # Q-table from disk (not saved)
+    main.BULK_REPEATS = settings['bulk']
+    q_table = main.load_q_table()
+    q_table.epsilon = settings['epsilon']
+    country_list = main.new_world(settings['countries'], q_table, 'object', seed=settings['seed'])
+    for country in country_list:
+        country.reserve = settings['reserve']
+        country.mines = settings['reserve'] // 100
+        country.towns = main.POWER_LEVELS[-1]
+        country.find_power_level()
+
+    start = time.perf_counter()
+    main.play_game(country_list, settings['turns'], first_turn=settings['first_turn'])
+    seconds = time.perf_counter() - start
+    reserves, incomes = main.game_results(country_list)
+    country_turns = settings['countries'] * (settings['turns'] - settings['first_turn'])
+    connection.send({
+        'benchmark': name,
+        **settings,
+        'seconds': seconds,
+        'country_turns_per_second': country_turns / seconds if seconds else 0,
+        'peak_memory_kb': peak_memory_kb(),
+        'highest_reserve': max(reserves),
+        'highest_income': max(incomes),
+    })
+
+
+def microseconds(function, seconds=0.2):
+    # Average time of a call, over at least 3 calls and about seconds in all
+    calls, start = 0, time.perf_counter()
+    while calls < 3 or time.perf_counter() - start < seconds:
+        function()
+        calls += 1
+    return (time.perf_counter() - start) / calls * 10 ** 6
+
+
+def run_fork(name, settings, connection):
+    q_table = main.load_q_table()
+    q_table.epsilon = settings['epsilon']
+    country_list = main.new_world(settings['countries'], q_table, settings['engine'], seed=settings['seed'])
+    main.play_game(country_list, settings['turns'])
+
+    # Each random stream of a seeded world adds its getstate() to a snapshot, fork_world and lookahead rollouts skip them
+    row = {'benchmark': name, **settings}
+    for rngs, suffix in ((True, ''), (False, '_without_rngs')):
+        snapshot = country_list.snapshot(rngs)
+        row['snapshot_us' + suffix] = microseconds(lambda: country_list.snapshot(rngs))
+        row['restore_us' + suffix] = microseconds(lambda: country_list.restore(snapshot, rngs))
+    row['fork_us'] = microseconds(lambda: main.fork_world(snapshot, q_table))
+    row['peak_memory_kb'] = peak_memory_kb()
+    connection.send(row)
+
+
+def run_rule(name, settings, connection):
+    formula, table, arguments = RULES[settings['rule']]
+    rng = random.Random(settings['seed'])
+    calls = [arguments(rng) for _ in range(settings['calls'])]
+
+    def nanoseconds(function):
+        best = math.inf
+        for _ in range(5):
+            start = time.perf_counter()
+            for call in calls:
+                function(*call)
+            best = min(best, time.perf_counter() - start)
+        return best / len(calls) * 10 ** 9
+
+    formula_ns, table_ns = nanoseconds(formula), nanoseconds(table)
+    connection.send({
+        'benchmark': name,
+        **settings,
+        'formula_ns': formula_ns,
+        'table_ns': table_ns,
+        'saved_ns_per_call': formula_ns - table_ns,
+        'same_results': all(formula(*call) == table(*call) for call in calls),
+    })
+
+
+def run_benchmark(name, settings, target=run_variant):
+    # Every variant runs in a fresh process, so its peak memory isn't hidden by an earlier, bigger one
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=target, args=(name, settings, sender))
+    process.start()
+    row = receiver.recv()
+    process.join()
+    return row
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times training runs and prints one JSON object per benchmark.')
+    parser.add_argument('suites', nargs='*', default=['standard', 'scaled'], choices=[*SUITES, 'late', 'fork', 'rules'])
+    parser.add_argument('--output', help='also append the JSON lines to this file')
+    parser.add_argument('--games', type=int, help='override the number of games of every benchmark')
+    parser.add_argument('--seed', type=int, help='play every benchmark on the random streams of this master seed')
+    parser.add_argument('--profile', action='store_true', help='add the TurnProfiler phase breakdown to each line')
+    args = parser.parse_args()
+
+    for suite in args.suites:
+        if suite == 'late':
+            benchmarks = [(name, settings, run_late_game) for name, settings in LATE_GAME_SUITE]
+        elif suite == 'fork':
+            benchmarks = [(name, settings, run_fork) for name, settings in FORK_SUITE]
+        elif suite == 'rules':
+            benchmarks = [(name, settings, run_rule) for name, settings in RULES_SUITE]
+        else:
+            benchmarks = [(name, settings, run_variant) for name, settings in SUITES[suite]]
+
+        for benchmark_name, benchmark_settings, target in benchmarks:
+            if args.games and target is run_variant:
+                benchmark_settings = dict(benchmark_settings, games=args.games)
+            if args.seed is not None:
+                benchmark_settings = dict(benchmark_settings, seed=args.seed)
+            if (args.profile and target is run_variant and benchmark_settings.get('batch', 1) == 1
+                    and benchmark_settings.get('workers', 1) == 1):  # what can be profiled
+                benchmark_settings = dict(benchmark_settings, profile=True)
+            line = json.dumps({'suite': suite, 'time': time.time(),
+                               **run_benchmark(benchmark_name, benchmark_settings, target)})
+            print(line, flush=True)
+            if args.output:
+                with open(args.output, 'a') as file:
+                    file.write(line + '\n')
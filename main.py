@@ -2,19 +2,76 @@ import random
 import math
 import json
 import ast
+import bisect
+import cProfile
+import csv
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+# Runs on Python 3.12 or newer (its f-strings nest quotes of the same kind). numpy is optional: only ENGINE = 'array'
+# (ArrayWorld) and batched training (BatchEnv, SimulationConfig.batch > 1) need it, everything else falls back to the
+# standard library, just slower. Install it with `pip install numpy`
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 COUNTRY_COUNT = 10
 PERCEPTION_VALUE = 3
 POWER_LEVELS = [0, 5, 10, 16]
 MAX_CONNECTIONS = [0, 1, 3, 5]
 PLAYERS = []  # All player indexes (can be empty)
-
-country_list = []
-
-q_table = {}
-epsilon = 0.01  # chance of mutation
-alpha = 0.5  # learning rate
-gamma = 0.7  # discount factor
+MAX_MONEY_LEVEL = 8
+MAX_TURN_LEVEL = 10
+TURN_LEVEL_TURNS = 20  # turns per turn level
+MAX_CONNECTION_LEVEL = 3
+# Method names of the actions the Q-table scores, by action index (the same in every engine)
+ACTIONS = ('purchase_mine', 'purchase_town', 'purchase_connection', 'purchase_blockade', 'remove_connection',
+           'remove_blockade', 'do_nothing')
+PURCHASE_MINE = ACTIONS.index('purchase_mine')
+PURCHASE_TOWN = ACTIONS.index('purchase_town')
+PURCHASE_CONNECTION = ACTIONS.index('purchase_connection')
+REMOVE_CONNECTION = ACTIONS.index('remove_connection')
+DO_NOTHING = ACTIONS.index('do_nothing')
+# Actions that only draw random numbers when they change something, so one that changed nothing stays a no-op
+DRAWLESS_NO_OPS = {PURCHASE_MINE, PURCHASE_TOWN, ACTIONS.index('purchase_blockade'), ACTIONS.index('remove_blockade')}
+BULK_REPEATS = True  # execute_actions repeats greedy actions through repeat_greedy, same results as one pass at a time
+EXACT_FLOATS = 2 ** 53  # money is whole numbers, which add up exactly in a float below this
+LOOKAHEAD_ROLLOUTS = 4  # rollouts a Lookahead plays per action...
+LOOKAHEAD_TURNS = 3  # ...each for the rest of the turn and this many more
+# Training saves to Q_TABLE_FILE, which isn't tracked; the tracked q_table.json is the starting table it is imported
+# from when it doesn't exist yet
+Q_TABLE_FILE = 'q_table.bin'
+Q_TABLE_MAGIC = b'QTB1'
+CHECKPOINT_GAMES = 10  # a TrainingSession saves after this many games...
+CHECKPOINT_SECONDS = 60  # ...or this many seconds, whichever comes first (None disables either)
+REPLAY_MAGIC = b'RPL1'
+# Kinds of the events in a replay file, see ReplayLog
+EVENT_GAME, EVENT_END, EVENT_MINES, EVENT_TOWNS, EVENT_CONNECTION, EVENT_DISCONNECT, EVENT_BLOCK, EVENT_UNBLOCK = range(8)
+
+# The step functions of the rules as lookup tables, built from the constants above and shared by every engine.
+# Each gives exactly what the formula next to it would
+MONEY_THRESHOLDS = tuple(25 * level ** 2 for level in range(1, MAX_MONEY_LEVEL))  # int(sqrt(reserve) / 5) >= level
+TURN_LEVELS = tuple(turn // TURN_LEVEL_TURNS + 1 for turn in range((MAX_TURN_LEVEL - 1) * TURN_LEVEL_TURNS))  # then max
+MINE_BUDGETS = tuple(min((0.01 * (100 - turn) * 3), 1) for turn in range(101))  # share of the reserve spent on mines
+CONNECTION_DIVISORS = tuple(max(1, 6 - level) for level in range(MAX_CONNECTION_LEVEL + 2))  # by connection level
+CONNECTION_DIVISOR_ARRAY = np.array(CONNECTION_DIVISORS) if np is not None else None
+MINE_BUDGET_ARRAY = np.array(MINE_BUDGETS) if np is not None else None
+
+EXPERIENCE_CAPACITY = 100_000  # transitions an ExperienceBuffer keeps
+EXPERIENCE_BATCH = 256  # transitions per batch of QTable.replay...
+EXPERIENCE_REPLAYS = 2  # ...which makes about this many updates per recorded transition
+
+EPSILON = 0.01  # chance of mutation
+ALPHA = 0.5  # learning rate
+GAMMA = 0.7  # discount factor
 
 '''
 To-Do list:
@@ -25,129 +82,961 @@ To-Do list:
 #  Current/Best model benchmarks: ~20.2 T (highest reserve), ~280 B (average reserve), ~5.06 T (highest income per turn)
 
 
-def load_q_table(filename='q_table.json'):
-    global q_table
+class StateTelemetry:
+    # How a QTable's states are used over a training run: visits (select_action calls) and the game each state was
+    # last seen in, per state_index, and how many visits found their state already in the table (hits) or added it
+    def __init__(self, state_count):
+        self.visits = array('q', bytes(8 * state_count))
+        self.last_seen = array('q', [-1]) * state_count  # -1 for never
+        self.games = 0  # games finished so far, the train loops count them
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0  # states the last pruned checkpoint left out of the saved table
+
+    def visit(self, index, present, times=1):
+        # times visits in a row, only the first of which can add the state
+        self.visits[index] += times
+        self.last_seen[index] = self.games
+        if present:
+            self.hits += times
+        else:
+            self.misses += 1
+            self.hits += times - 1
+
+    def visit_many(self, indices, present, times=1):
+        # visit for numpy arrays of indices, of their presence bytes and of the visits in a row of each (or 1)
+        times = np.broadcast_to(times, np.shape(indices))
+        np.add.at(np.frombuffer(self.visits, dtype=np.int64), indices, times)
+        np.frombuffer(self.last_seen, dtype=np.int64)[indices] = self.games
+        misses = len(indices) - int(np.count_nonzero(present))
+        self.hits += int(times.sum()) - misses
+        self.misses += misses
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+    def report(self, q_table):
+        visited = sum(1 for visits in self.visits if visits)
+        # unvisited_states are rows of the table this run has never needed
+        return dict(states=len(q_table), state_space=q_table.state_count, coverage=len(q_table) / q_table.state_count,
+                    visited_states=visited,
+                    unvisited_states=sum(1 for present, visits in zip(q_table.present, self.visits) if present and not visits),
+                    table_bytes=len(q_table.values) * 8 + len(q_table.present) + len(q_table.greedy),
+                    visits=self.hits + self.misses, hit_rate=self.hit_rate, pruned_states=self.pruned)
+
+
+class ExperienceBuffer:
+    # Ring buffer of the last capacity Q-learning transitions (state index, action, reward, next state index) of
+    # every AI country, in preallocated arrays, for QTable.replay. Once it is full the oldest are overwritten
+    def __init__(self, capacity=EXPERIENCE_CAPACITY, seed=None):
+        if capacity < 1:
+            raise ValueError('An experience buffer needs room for at least one transition')
+        self.capacity = capacity
+        self.states = array('q', bytes(8 * capacity))
+        self.actions = array('B', bytes(capacity))
+        self.rewards = array('d', bytes(8 * capacity))
+        self.next_states = array('q', bytes(8 * capacity))
+        self.position = 0  # where the next transition goes
+        self.size = 0  # transitions in the buffer
+        self.added = 0  # transitions recorded since the last QTable.replay
+        if np is not None:
+            # numpy views of the same memory, for batched updates
+            self.states_array = np.frombuffer(self.states, dtype=np.int64)
+            self.actions_array = np.frombuffer(self.actions, dtype=np.uint8)
+            self.rewards_array = np.frombuffer(self.rewards)
+            self.next_states_array = np.frombuffer(self.next_states, dtype=np.int64)
+            self.rng = np.random.default_rng(seed)
+        else:
+            self.rng = random.Random(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state):
+        position = self.position
+        self.states[position] = state
+        self.actions[position] = action
+        self.rewards[position] = reward
+        self.next_states[position] = next_state
+        self.position = position + 1 if position + 1 < self.capacity else 0
+        if self.size < self.capacity:
+            self.size += 1
+        self.added += 1
+
+    def sample(self, count):
+        # Positions of count transitions drawn uniformly, with replacement
+        if np is not None:
+            return self.rng.integers(0, self.size, count)
+        return [self.rng.randrange(self.size) for _ in range(count)]
+
+
+def state_shape():
+    # Number of values each get_state field can take: (power level, money level, connections, turn level)
+    return len(POWER_LEVELS), MAX_MONEY_LEVEL, max(MAX_CONNECTIONS) + 1, MAX_TURN_LEVEL
+
+
+def state_index(state, shape=None):
+    power_levels, money_levels, connection_counts, turn_levels = shape or state_shape()
+    power_level, money_level, connection_count, turn_level = state
+    if not (1 <= power_level <= power_levels and 1 <= money_level <= money_levels
+            and 0 <= connection_count < connection_counts and 1 <= turn_level <= turn_levels):
+        raise ValueError(f'State {state} is outside of the state space {shape or state_shape()}')
+    return (((power_level - 1) * money_levels + money_level - 1) * connection_counts + connection_count) * turn_levels \
+        + turn_level - 1
+
+
+def index_state(index, shape=None):
+    _, money_levels, connection_counts, turn_levels = shape or state_shape()
+    index, turn_level = divmod(index, turn_levels)
+    index, connection_count = divmod(index, connection_counts)
+    power_level, money_level = divmod(index, money_levels)
+    return power_level + 1, money_level + 1, connection_count, turn_level + 1
+
+
+class QTable:
+    # Dense Q-table: one preallocated float64 array holding a row of action values per state_index, a byte per
+    # state telling whether the state has been seen, and each row's greedy action kept up to date on every write
+    def __init__(self, num_of_actions=len(ACTIONS), shape=None):
+        self.shape = tuple(shape or state_shape())
+        self.num_of_actions = num_of_actions
+        self.state_count = math.prod(self.shape)
+        self.values = array('d', bytes(8 * self.state_count * num_of_actions))
+        self.present = bytearray(self.state_count)
+        self.greedy = array('B', bytes(self.state_count))
+        self.visits = None  # array of updates per (state, action) while a train_worker is playing
+        self.experience = None  # ExperienceBuffer update records to instead of learning, see replay
+        self.telemetry = None  # StateTelemetry counting the visits of select_action(s)
+        self.epsilon = EPSILON
+        self.alpha = ALPHA
+        self.gamma = GAMMA
+
+        # state_index() as a dot product: index = power * s0 + money * s1 + connections * s2 + turn + offset
+        _, money_levels, connection_counts, turn_levels = self.shape
+        self.strides = (money_levels * connection_counts * turn_levels, connection_counts * turn_levels, turn_levels)
+        self.offset = -self.strides[0] - self.strides[1] - 1
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __len__(self):
+        return self.present.count(1)
+
+    def __contains__(self, state):
+        return bool(self.present[state_index(state, self.shape)])
+
+    def __getitem__(self, state):
+        index = state_index(state, self.shape)
+        return self.values[index * self.num_of_actions:(index + 1) * self.num_of_actions].tolist()
+
+    def __setitem__(self, state, row):
+        index = state_index(state, self.shape)
+        self.values[index * self.num_of_actions:(index + 1) * self.num_of_actions] = array('d', row)
+        self.present[index] = 1
+        self.greedy[index] = self.find_greedy(index)
+
+    def index(self, state):
+        power_level, money_level, connection_count, turn_level = state
+        # money and turn levels are clamped by discretize_state, only the connection count could run off its axis
+        if not 0 <= connection_count < self.shape[2]:
+            raise ValueError(f'State {state} is outside of the state space {self.shape}')
+        return power_level * self.strides[0] + money_level * self.strides[1] + connection_count * self.strides[2] \
+            + turn_level + self.offset
+
+    def find_greedy(self, index):
+        row = self.values[index * self.num_of_actions:(index + 1) * self.num_of_actions]
+        return row.index(max(row))  # first maximum, like max(range(n), key=...)
+
+    def rebuild_greedy(self):
+        if np is not None:
+            self.greedy = array('B', np.frombuffer(self.values).reshape(-1, self.num_of_actions).argmax(axis=1)
+                                .astype(np.uint8).tobytes())
+        else:
+            self.greedy = array('B', (self.find_greedy(index) for index in range(self.state_count)))
+
+    def indices(self, states):
+        # index of many states at once, a numpy array of shape (states, 4)
+        return np.asarray(states, dtype=np.int64) @ np.array((*self.strides, 1)) + self.offset
+
+    def select_actions(self, states, rng):
+        # select_action for many states at once, e.g. one per world of a BatchEnv, with all the epsilon draws made in
+        # one go by the numpy Generator rng
+        indices = self.indices(states)
+        if self.telemetry is not None:
+            self.telemetry.visit_many(indices, np.frombuffer(self.present, dtype=np.uint8)[indices])
+        np.frombuffer(self.present, dtype=np.uint8)[indices] = 1
+        actions = np.frombuffer(self.greedy, dtype=np.uint8)[indices].astype(np.int64)
+        explore = rng.random(len(actions)) < self.epsilon
+        actions[explore] = rng.integers(0, self.num_of_actions, np.count_nonzero(explore))
+        return actions
+
+    def select_action(self, state, rng=random):
+        index = self.index(state)
+        if self.telemetry is not None:
+            self.telemetry.visit(index, self.present[index])
+        self.present[index] = 1
+
+        if rng.random() < self.epsilon:
+            return rng.randint(0, self.num_of_actions - 1)
+        else:
+            return self.greedy[index]
+
+    def update(self, old_state, action_index, reward, new_state):
+        old_index, new_index = self.index(old_state), self.index(new_state)
+        self.present[old_index] = self.present[new_index] = 1
+        if self.experience is not None:
+            self.experience.add(old_index, action_index, reward, new_index)
+        else:
+            self.learn(old_index, action_index, reward, new_index)
+
+    # Q(s,a)←Q(s,a)+α⋅[r+γ⋅a′maxQ(s′,a′)−Q(s,a)]
+    def learn(self, old_index, action_index, reward, new_index):
+        num_of_actions = self.num_of_actions
+        position = old_index * num_of_actions + action_index
+        old_value = self.values[position]
+        future_estimate = self.values[new_index * num_of_actions + self.greedy[new_index]]
+        new_value = old_value + self.alpha * (reward + self.gamma * future_estimate - old_value)
+        self.values[position] = new_value
+
+        best = self.greedy[old_index]
+        best_value = self.values[old_index * num_of_actions + best] if best != action_index else old_value
+        if new_value > best_value or (new_value == best_value and action_index < best):
+            self.greedy[old_index] = action_index
+        elif best == action_index and new_value < old_value:
+            self.greedy[old_index] = self.find_greedy(old_index)
+
+        if self.visits is not None:
+            self.visits[position] += 1
+
+    def replay(self, batch_size=EXPERIENCE_BATCH, replays=EXPERIENCE_REPLAYS):
+        # Learns from self.experience: batches of batch_size transitions sampled from the whole buffer, about replays
+        # updates for every transition recorded since the last call. Returns the number of batches. With numpy every
+        # update of a batch is computed from the table as it was before the batch (of two updates of the same
+        # state and action the later one is kept), without it they are learned one at a time
+        experience = self.experience
+        batches = math.ceil(experience.added * replays / batch_size) if experience.size else 0
+        experience.added = 0
+        for _ in range(batches):
+            positions = experience.sample(batch_size)
+            if np is None:
+                for position in positions:
+                    self.learn(experience.states[position], experience.actions[position],
+                               experience.rewards[position], experience.next_states[position])
+                continue
+
+            states = experience.states_array[positions]
+            next_states = experience.next_states_array[positions]
+            values = np.frombuffer(self.values)
+            greedy = np.frombuffer(self.greedy, dtype=np.uint8)
+            updated = states * self.num_of_actions + experience.actions_array[positions]
+            future_estimates = values[next_states * self.num_of_actions + greedy[next_states]]
+            values[updated] += self.alpha * (experience.rewards_array[positions] + self.gamma * future_estimates
+                                             - values[updated])
+            rows = np.unique(states)
+            greedy[rows] = values.reshape(-1, self.num_of_actions)[rows].argmax(axis=1)
+        return batches
+
+    def prune(self, max_states=None, min_visits=0, telemetry=None):
+        # Bounded mode: forgets the states visited fewer than min_visits times, then all but the max_states most
+        # visited ones (the least recently seen go first among equal visits), by telemetry (self.telemetry by default)
+        # since it was attached. Returns the number of states forgotten. The table stays as large: its rows are only
+        # emptied
+        telemetry = telemetry or self.telemetry
+        if telemetry is None:
+            raise ValueError('Pruning needs the visit counts of a StateTelemetry')
+        states = [index for index in range(self.state_count) if self.present[index]]
+        kept = [index for index in states if telemetry.visits[index] >= min_visits]
+        if max_states is not None and len(kept) > max_states:
+            kept.sort(key=lambda index: (telemetry.visits[index], telemetry.last_seen[index]), reverse=True)
+            kept = kept[:max_states]
+
+        forgotten = set(states).difference(kept)
+        empty_row = array('d', bytes(8 * self.num_of_actions))
+        for index in forgotten:
+            self.values[index * self.num_of_actions:(index + 1) * self.num_of_actions] = empty_row
+            self.present[index] = 0
+            self.greedy[index] = 0
+        return len(forgotten)
+
+    def decay(self, rate):
+        self.epsilon = max(0.001, self.epsilon * rate)
+        self.alpha = max(0.01, self.alpha * rate)
+
+    def copy(self):
+        table = QTable(self.num_of_actions, self.shape)
+        table.values = array('d', self.values)
+        table.present = bytearray(self.present)
+        table.greedy = array('B', self.greedy)
+        table.epsilon, table.alpha, table.gamma = self.epsilon, self.alpha, self.gamma
+        return table
+
+    def to_dict(self):
+        num_of_actions = self.num_of_actions
+        return {index_state(index, self.shape): self.values[index * num_of_actions:(index + 1) * num_of_actions].tolist()
+                for index in range(self.state_count) if self.present[index]}
+
+    @classmethod
+    def from_dict(cls, data, num_of_actions=len(ACTIONS)):
+        table = cls(num_of_actions)
+        for state, row in data.items():
+            # Rows of another action count would be reset to zeros on their first use anyway
+            if len(row) == num_of_actions:
+                table[state] = row
+        return table
+
+
+class GreedyPolicy:
+    # A trained QTable frozen for evaluation: the greedy action of every state, copied out of the table once, so
+    # choosing an action is a single lookup without epsilon draws, and nothing is written back
+    def __init__(self, q_table):
+        self.shape = q_table.shape
+        self.strides = q_table.strides
+        self.offset = q_table.offset
+        self.actions = bytes(q_table.greedy)
+
+    def action(self, state):
+        power_level, money_level, connection_count, turn_level = state
+        if not 0 <= connection_count < self.shape[2]:
+            raise ValueError(f'State {state} is outside of the state space {self.shape}')
+        return self.actions[power_level * self.strides[0] + money_level * self.strides[1]
+                            + connection_count * self.strides[2] + turn_level + self.offset]
+
+
+def read_q_table_json(filename):
     try:
         with open(filename, 'r') as file:
             data = json.load(file)
-            q_table = {ast.literal_eval(k): v for k, v in data.items()}
+            return {ast.literal_eval(k): v for k, v in data.items()}
     except FileNotFoundError:
-        q_table = {}
+        return {}
 
 
-def save_q_table(filename='q_table.json'):
+def write_q_table_json(table, filename):
     with open(filename, 'w') as file:
-        json.dump({str(k): v for k, v in q_table.items()}, file)
+        json.dump({str(k): v for k, v in table.items()}, file)
+
+
+# Binary layout: magic, the state shape and action count as 5 uint16, one presence byte per state,
+# then a dense little-endian float64 array of shape (states, actions) indexed by state_index
+def read_q_table_binary(filename):
+    with open(filename, 'rb') as file:
+        data = file.read()
+
+    header = struct.Struct('<4s5H')
+    magic, *shape, num_of_actions = header.unpack_from(data)
+    if magic != Q_TABLE_MAGIC:
+        raise ValueError(f'{filename} is not a binary Q-table')
+    state_count = math.prod(shape)
+
+    table = QTable(num_of_actions, shape)
+    table.present = bytearray(data[header.size:header.size + state_count])
+    table.values = array('d')
+    table.values.frombytes(data[header.size + state_count:])
+    if sys.byteorder == 'big':
+        table.values.byteswap()
+    if len(table.values) != state_count * num_of_actions:
+        raise ValueError(f'{filename} is truncated')
+    table.rebuild_greedy()
+
+    # A table saved under other POWER_LEVELS/MAX_CONNECTIONS/... is moved over to the current state space
+    return table if table.shape == state_shape() else QTable.from_dict(table.to_dict(), num_of_actions)
+
+
+def write_q_table_binary(table, filename):
+    values = table.values
+    if sys.byteorder == 'big':
+        values = array('d', values)
+        values.byteswap()
+
+    with open(filename, 'wb') as file:
+        file.write(struct.pack('<4s5H', Q_TABLE_MAGIC, *table.shape, table.num_of_actions))
+        file.write(table.present)
+        file.write(values.tobytes())
+
+
+def load_q_table(filename=Q_TABLE_FILE):
+    if filename.endswith('.json'):
+        return QTable.from_dict(read_q_table_json(filename))
+    elif os.path.exists(filename):
+        return read_q_table_binary(filename)
+    else:
+        return QTable.from_dict(read_q_table_json(os.path.splitext(filename)[0] + '.json'))
+
+
+def q_table_exists(filename=Q_TABLE_FILE):
+    # Whether load_q_table finds a table in filename (or in the .json file it falls back to) instead of starting an
+    # empty one
+    return os.path.exists(filename) or (not filename.endswith('.json')
+                                        and os.path.exists(os.path.splitext(filename)[0] + '.json'))
+
+
+def save_q_table(table, filename=Q_TABLE_FILE):
+    # Written next to the target and renamed over it, so the file on disk is always a complete table
+    temp_filename = filename + '.tmp'
+    if filename.endswith('.json'):
+        write_q_table_json(table.to_dict(), temp_filename)
+    else:
+        write_q_table_binary(table, temp_filename)
+    os.replace(temp_filename, filename)
+
+
+class TrainingSession:
+    # Loads q_table once for a whole training run and checkpoints it from a background writer thread.
+    # Use it as a context manager: leaving the block (normally, by error or by KeyboardInterrupt) writes a final save.
+    # A read_only session loads the table the same way but never writes it back. A required table must exist rather
+    # than start empty, as when a frozen policy is played. With max_states or min_visits every checkpoint saves a
+    # pruned copy of the table (see QTable.prune), which needs its telemetry
+    def __init__(self, filename=Q_TABLE_FILE, every_games=CHECKPOINT_GAMES, every_seconds=CHECKPOINT_SECONDS,
+                 read_only=False, max_states=None, min_visits=0, required=False):
+        if required and not q_table_exists(filename):
+            raise FileNotFoundError(f'No Q-table in {filename}')
+        self.filename = filename
+        self.every_games = every_games
+        self.every_seconds = every_seconds
+        self.read_only = read_only
+        self.max_states = max_states
+        self.min_visits = min_visits
+        self.games_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+        self.saves = 0
+        self.save_seconds = 0.0  # spent by the writer thread
+        self.saved_bytes = None  # size of the last file written
+
+        self._pending = None  # newest table copy waiting to be written, older ones are skipped
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._writer = threading.Thread(target=self._write_checkpoints, daemon=True)
+
+        start = time.perf_counter()
+        self.q_table = load_q_table(filename)
+        self.load_seconds = time.perf_counter() - start
+        if not read_only:
+            self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def game_finished(self, games=1):
+        self.games_since_checkpoint += games
+        if ((self.every_games is not None and self.games_since_checkpoint >= self.every_games)
+                or (self.every_seconds is not None and time.monotonic() - self.last_checkpoint >= self.every_seconds)):
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.read_only:
+            return
+
+        # The copy is taken here so the writer never sees a table that training is still updating. Only the copy is
+        # pruned, so training goes on with every state it has learned and when checkpoints happen (also by time)
+        # never changes the games. Pruning frees no memory, nor makes a binary file smaller, as a QTable and its
+        # file are dense; it bounds which states are kept from one run to the next (and the size of a .json file)
+        table = self.q_table.copy()
+        if self.max_states is not None or self.min_visits:
+            telemetry = self.q_table.telemetry
+            telemetry.pruned = table.prune(self.max_states, self.min_visits, telemetry)
+        with self._condition:
+            self._pending = table
+            self._condition.notify()
+
+        self.games_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        if self._closed:
+            return
+        self.checkpoint()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if not self.read_only:
+            self._writer.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _write_checkpoints(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                table, self._pending = self._pending, None
+
+            start = time.perf_counter()
+            try:
+                save_q_table(table, self.filename)
+                self.saved_bytes = os.path.getsize(self.filename)
+            except OSError as error:
+                self._error = error
+            self.saves += 1
+            self.save_seconds += time.perf_counter() - start
+
+
+def discretize_state(power_level, reserve, connection_count, turn):
+    # money level min(int(sqrt(max(0, reserve)) / 5) + 1, MAX_MONEY_LEVEL), turn level
+    # min(turn // TURN_LEVEL_TURNS, MAX_TURN_LEVEL - 1) + 1
+    money_level = bisect.bisect_right(MONEY_THRESHOLDS, reserve) + 1
+    turn_level = TURN_LEVELS[turn] if 0 <= turn < len(TURN_LEVELS) else min(turn // TURN_LEVEL_TURNS, MAX_TURN_LEVEL - 1) + 1
+
+    return power_level, money_level, connection_count, turn_level
+
+
+def discretize_states(power_levels, reserves, connection_counts, turns):
+    # discretize_state of many countries at once, as an array of shape (countries, 4)
+    states = np.empty((len(reserves), 4), dtype=np.int64)
+    states[:, 0] = power_levels
+    states[:, 1] = np.searchsorted(MONEY_THRESHOLDS, reserves, side='right') + 1
+    states[:, 2] = connection_counts
+    states[:, 3] = np.minimum(turns // TURN_LEVEL_TURNS, MAX_TURN_LEVEL - 1) + 1
+    return states
+
+
+def mine_budget(turn):
+    # Share of its reserve a country spends on mines in purchase_mine
+    if 0 <= turn < len(MINE_BUDGETS):
+        return MINE_BUDGETS[turn]
+    return min((0.01 * (100 - turn) * 3), 1)
+
+
+def merge_q_tables(snapshot, tables):
+    # Every (state, action) a worker updated becomes the visit-weighted average of the workers' values,
+    # everything else keeps its snapshot value
+    merged = snapshot.copy()
+    for table in tables:
+        merged.present = bytearray(a | b for a, b in zip(merged.present, table.present))
+
+    value_sums = [0] * len(merged.values)
+    count_sums = [0] * len(merged.values)
+    for table in tables:
+        for position, count in enumerate(table.visits):
+            if count:
+                value_sums[position] += count * table.values[position]
+                count_sums[position] += count
+
+    for position, count in enumerate(count_sums):
+        if count:
+            merged.values[position] = value_sums[position] / count
+    merged.rebuild_greedy()
+
+    return merged
+
+
+def random_streams(seed, count):
+    # One random stream per country of a game, all derived from the game's seed, so a country's draws don't depend
+    # on how many numbers the others used. Without a seed every country shares the global random module
+    if seed is None:
+        return [random] * count
+    game_stream = random.Random(seed)
+    return [random.Random(game_stream.getrandbits(64)) for _ in range(count)]
+
+
+class Connection:
+    # One export link. The same record sits in the exporter's connections and the importer's imports,
+    # so level and blockade changes are seen from both sides
+    __slots__ = ('importer', 'level', 'blocked')
+
+    def __init__(self, importer, level=1, blocked=False):
+        self.importer = importer
+        self.level = level
+        self.blocked = blocked
+
+    def __repr__(self):
+        return f'[{self.importer}, {self.level}, {self.blocked}]'
+
+
+class World(list):
+    # The country_list of a game. Besides its Countries it ranks them by floor((towns + markets) / 5): every exporter
+    # scores the importers it has no connection to and no perception of at 4 times that minus 6 (see
+    # Countries.best_targets), so the best of those is found here once for the whole world instead of per exporter
+    def __init__(self, count):
+        super().__init__([None] * count)
+        self.reset()
+
+    def reset(self):
+        # Every country starts without towns or markets
+        self.ranks = [0] * len(self)
+        self.ranked = {0: list(range(len(self)))}  # {rank: sorted indexes of the countries with that rank}
+        self.ranks_in_use = [0]  # sorted keys of ranked
+
+    def resized(self, country):
+        # country's towns or markets changed
+        rank = (country.towns + country.markets) // 5
+        old_rank = self.ranks[country.name]
+        if rank == old_rank:
+            return
+        self.ranks[country.name] = rank
+
+        old_countries = self.ranked[old_rank]
+        del old_countries[bisect.bisect_left(old_countries, country.name)]
+        if not old_countries:
+            del self.ranked[old_rank]
+            del self.ranks_in_use[bisect.bisect_left(self.ranks_in_use, old_rank)]
+        if rank not in self.ranked:
+            self.ranked[rank] = []
+            bisect.insort(self.ranks_in_use, rank)
+        bisect.insort(self.ranked[rank], country.name)
+
+    def rng_streams(self):
+        # The distinct random streams of the countries, in order of first use
+        return list({id(country.rng): country.rng for country in self}.values())
+
+    def snapshot(self, rngs=True):
+        # Everything a game's future depends on (the random streams too, unless rngs is False), as flat lists of
+        # numbers that share nothing with the world
+        countries, imports, perception = [], [], []
+        for country in self:
+            countries += (country.towns, country.markets, country.mines, country.power_level, country.reserve,
+                          country.life_time_earning, country.changes, len(country.connections))
+            for connection in country.connections:
+                countries += (connection.importer, connection.level, connection.blocked)
+            imports.append(len(country.imports))
+            imports += country.imports
+            perception.append(len(country.perception))
+            for item in country.perception.items():
+                perception += item
+        rng_states = [rng.getstate() for rng in self.rng_streams()] if rngs else None
+        return WorldSnapshot(len(self), 'object', (countries, imports, perception), rng_states)
+
+    def restore(self, snapshot, rngs=True):
+        # Back to the moment of snapshot, in place. The countries keep their q_table, log and player seats
+        if snapshot.engine != 'object' or snapshot.count != len(self):
+            raise ValueError(f'Can\'t restore a snapshot of {snapshot.count} countries ({snapshot.engine} engine) '
+                             f'into a world of {len(self)}')
+        countries, imports, perception = snapshot.data
+
+        links = {}  # {(exporter, importer): connection}
+        position = 0
+        for country in self:
+            (country.towns, country.markets, country.mines, country.power_level, country.reserve,
+             country.life_time_earning, country.changes, connection_count) = countries[position:position + 8]
+            position += 8
+            country.connections.clear()
+            for _ in range(connection_count):
+                connection = Connection(*countries[position:position + 3])
+                position += 3
+                country.connections.append(connection)
+                links[country.name, connection.importer] = connection
+            country.income = None
+
+        import_position = perception_position = 0
+        for country in self:
+            import_count = imports[import_position]
+            country.imports = {exporter: links[exporter, country.name]
+                               for exporter in imports[import_position + 1:import_position + 1 + import_count]}
+            import_position += 1 + import_count
+            perception_count = perception[perception_position]
+            values = perception[perception_position + 1:perception_position + 1 + 2 * perception_count]
+            country.perception = dict(zip(values[::2], values[1::2]))
+            perception_position += 1 + 2 * perception_count
+
+        self.reset()
+        for country in self:
+            self.resized(country)
+        if rngs and snapshot.rng_states is not None:
+            restore_rng_states(self.rng_streams(), snapshot.rng_states)
+
+    def top_ranked(self, excluded):
+        # (rank, countries of that rank, the excluded ones among them) of the best rank with a country that isn't
+        # excluded, or None when every country is
+        for rank in reversed(self.ranks_in_use):
+            countries = self.ranked[rank]
+            skipped = sorted(j for j in excluded if self.ranks[j] == rank)
+            if len(skipped) < len(countries):
+                return rank, countries, skipped
+        return None
+
+
+class WorldSnapshot:
+    # A world at one moment, taken by World.snapshot or ArrayWorld.snapshot. Nothing in it is shared with the world
+    # or changed by restoring it, so it can be restored any number of times, into its world or into a fork_world
+    __slots__ = ('count', 'engine', 'data', 'rng_states')
+
+    def __init__(self, count, engine, data, rng_states=None):
+        self.count = count
+        self.engine = engine
+        self.data = data
+        self.rng_states = rng_states  # getstate() of the world's distinct random streams, or None
+
+
+def restore_rng_states(streams, states):
+    if len(streams) != len(states):
+        raise ValueError(f'The snapshot has {len(states)} random streams, the world {len(streams)}')
+    for rng, state in zip(streams, states):
+        rng.setstate(state)
+
+
+class BestTargets:
+    # The importers tied for the best purchase_connection score of an exporter, in country_list order, without
+    # listing the unrelated ones: those are the ranked countries of a World rank, minus the skipped ones
+    __slots__ = ('related', 'ranked', 'skipped', 'count')
+
+    def __init__(self, related, ranked=(), skipped=()):
+        self.related = related  # sorted importers the exporter has a connection to or a perception of
+        self.ranked = ranked
+        self.skipped = skipped
+        self.count = len(related) + len(ranked) - len(skipped)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        # Related importers come before the unrelated ones with a greater index
+        for j in self.related:
+            before = bisect.bisect_left(self.ranked, j) - bisect.bisect_left(self.skipped, j)
+            if position == before:
+                return j
+            if position < before:
+                break
+            position -= 1
+
+        index = position  # position-th of ranked minus skipped
+        for j in self.skipped:
+            if j <= self.ranked[index]:
+                index += 1
+            else:
+                break
+        return self.ranked[index]
+
+
+class ConsoleSeat:
+    # A player at this terminal. Countries.play_turn and the player branches of the actions only talk to their
+    # country's seat, so server.py's GameServer can put a player on a socket instead
+    def ask(self, prompt):
+        return input(prompt)
+
+    def tell(self, text):
+        print(text)
+
+
+CONSOLE = ConsoleSeat()
 
 
 class Countries:
-    def __init__(self, index):
+    __slots__ = ('name', 'world', 'q_table', 'towns', 'markets', 'mines', 'connections', 'imports', 'power_level',
+                 'reserve', 'life_time_earning', 'perception', 'player', 'seat', 'income', 'rng', 'log', 'changes')
+
+    def __init__(self, index, world, q_table=None, rng=random):
         self.name = index
+        self.world = world  # the World this country plays in, already sized to every country in the game
+        self.connections = []
+        self.imports = {}  # {exporter_index: connection} for every connection pointing at this country
+        self.reset(q_table, rng)
+
+        self.player = False
+        if index in PLAYERS:
+            self.player = True
+        self.seat = CONSOLE  # where a player's prompts go and its answers come from
+
+    def reset(self, q_table=None, rng=random):
+        # Back to the start of a game, so new_world can reuse the same objects for the next one
+        self.q_table = q_table
+        self.rng = rng  # every random decision of this country draws from it
+        self.log = None  # ReplayLog the changes this country makes are recorded to, set by play_game
         self.towns = 0
         self.markets = 0
         self.mines = 0
-        self.connections = []
+        self.connections.clear()
+        self.imports.clear()
         self.power_level = 1
         self.reserve = 0
         self.life_time_earning = 0
-        self.perception = [0] * COUNTRY_COUNT
-        self.actions = (self.purchase_mine, self.purchase_town, self.purchase_connection, self.purchase_blockade,
-                        self.remove_connection, self.remove_blockade, self.do_nothing)
-
-        self.player = False
-        if index in PLAYERS:
-            self.player = True
+        self.perception = {}  # {country: perception}, countries without an entry are perceived at 0
+        self.income = None  # cached generate_money(False), None once something it depends on has changed
+        self.changes = 0  # number of changes this country has made, see repeat_greedy
 
     def __repr__(self):
         return (f"\n{self.name} = Towns: {self.towns} + {self.markets} ({self.power_level}), "
                 f"Mines: {self.mines}, Connections: {self.connections}, Money: {self.reserve} ({self.life_time_earning})")
 
     def find_power_level(self):
-        for level, min_towns in enumerate(POWER_LEVELS):
-            if (self.towns + self.markets) >= min_towns:
-                self.power_level = level + 1
-
-    def generate_money(self, generated=True):
+        power_level = bisect.bisect_right(POWER_LEVELS, self.towns + self.markets)  # levels reached
+        if power_level != self.power_level:
+            self.power_level = power_level
+            self.income = None
+
+    def invalidate_exporters(self):
+        # This country's towns and markets changed, which is part of the income of every country exporting to it
+        # and of the score every other country gives it as an importer
+        for exporter in self.imports:
+            self.world[exporter].income = None
+        self.world.resized(self)
+
+    def compute_income(self):
+        # Income from scratch. It depends on this country's mines, power level and connections, on the towns and
+        # markets of its importers and on whether those importers block their own connection back to this country.
+        # Every change to one of those resets the income cache of the countries it affects
         income = self.mines + self.power_level
+        half_mines = self.mines // 2
 
         for connection in self.connections:
-            is_not_blockaded = True
+            importer_connection = self.imports.get(connection.importer)
 
-            for importer_connection in country_list[connection[0]].connections:
-                if importer_connection[0] == self.name and importer_connection[2]:
-                    is_not_blockaded = False
-                    break
+            if importer_connection is None or not importer_connection.blocked:
+                importer = self.world[connection.importer]
+                income += half_mines + (importer.towns + importer.markets) // CONNECTION_DIVISORS[connection.level]
 
-            if is_not_blockaded:
-                income += math.floor(self.mines / 2)
-                income += math.floor((country_list[connection[0]].towns + country_list[connection[0]].markets) / max(1, 6 - connection[1]))
-                if generated:
-                    country_list[connection[0]].reserve -= connection[1]
+        return income
 
-        if generated:
-            self.reserve += income
-            self.life_time_earning += income
-        else:
-            return income
+    def generate_money(self, generated=True):
+        if self.income is None:
+            self.income = self.compute_income()
+
+        if not generated:
+            return self.income
+
+        for connection in self.connections:
+            importer_connection = self.imports.get(connection.importer)
+
+            if importer_connection is None or not importer_connection.blocked:
+                self.world[connection.importer].reserve -= connection.level
+
+        self.reserve += self.income
+        self.life_time_earning += self.income
 
     def find_perception(self):
+        # Only countries with a connection either way, or with a perception last turn, can be perceived at all,
+        # so the sparse perception is rebuilt from those
         pre_perception = self.perception
-        self.perception = [0] * COUNTRY_COUNT
-        for country in country_list:
-            for connection in country.connections:
-                if connection[0] == self.name:
-                    self.perception[country.name] += 10 * connection[1]
-                    if connection[2]:
-                        self.perception[country.name] -= 15 + 5 * connection[1]
+        perception = {}
+        for exporter, connection in self.imports.items():
+            perception[exporter] = 10 * connection.level
+            if connection.blocked:
+                perception[exporter] -= 15 + 5 * connection.level
 
         for connection in self.connections:
-            if connection[2]:
-                self.perception[connection[0]] += 5 * connection[1]
+            if connection.blocked:
+                perception[connection.importer] = perception.get(connection.importer, 0) + 5 * connection.level
             else:
-                self.perception[connection[0]] += 10 + 4 * connection[1]
-
-        for j, old_perception in enumerate(pre_perception):
-            if old_perception > self.perception[j]:
-                self.perception[j] -= 10
+                perception[connection.importer] = perception.get(connection.importer, 0) + 10 + 4 * connection.level
+
+        for j in pre_perception.keys() | perception.keys():
+            if pre_perception.get(j, 0) > perception.get(j, 0):
+                perception[j] = perception.get(j, 0) - 10
+        self.perception = {j: value for j, value in perception.items() if value}
+
+    def incoming_connections(self, blocked=None):
+        # (exporter, connection) pairs pointing at this country, in country_list order
+        return [(self.world[exporter], connection) for exporter, connection in sorted(self.imports.items())
+                if blocked is None or connection.blocked == blocked]
+
+    # Every change a turn makes to the world goes through the methods below, which also record it when the game is
+    # logged. replay_game calls the same methods with the recorded arguments
+
+    def add_mines(self, mines, cost):
+        self.reserve -= cost
+        self.mines += mines
+        self.income = None
+        if mines:
+            self.changes += 1
+            if self.log is not None:
+                self.log.record(EVENT_MINES, mines, cost)
+
+    def add_towns(self, towns, cost):
+        self.reserve -= cost
+        self.towns += towns
+        self.changes += 1
+        self.invalidate_exporters()
+        if self.log is not None:
+            self.log.record(EVENT_TOWNS, towns, cost)
+
+    def connect(self, importer, cost, connected=True, times=1):
+        # Opens or upgrades the connection to importer. connected is False when this country is maxed out on
+        # connections, the importer still gets its starting bonus. times > 1 buys that bonus several times in a row
+        if connected:
+            connection = self.world[importer].imports.get(self.name)
+            if connection is not None:
+                connection.level += 1
+            else:
+                connection = Connection(importer)
+                self.connections.append(connection)
+                self.world[importer].imports[self.name] = connection
+            self.income = None
+
+        # Starting bonus for importer, also allows for an instant blockade (blockade cost = 3)
+        self.world[importer].reserve += 3 * times
+        self.world[importer].life_time_earning += 3 * times
+        self.world[importer].markets += times
+        self.world[importer].invalidate_exporters()
+
+        self.reserve -= cost * times
+        self.changes += 1
+        if self.log is not None:
+            for _ in range(times):
+                self.log.record(EVENT_CONNECTION, importer, cost, connected)
+
+    def drop_connection(self, connection):
+        self.connections.remove(connection)
+        del self.world[connection.importer].imports[self.name]
+        self.income = None
+        self.world[connection.importer].income = None
+        self.changes += 1
+        if self.log is not None:
+            self.log.record(EVENT_DISCONNECT, connection.importer)
+
+    def disconnect(self, importer):
+        self.drop_connection(self.world[importer].imports[self.name])
+
+    def block(self, exporter, cost):
+        connection = self.imports[exporter]
+        connection.blocked = True
+        self.world[exporter].markets = max(0, (self.world[exporter].markets - connection.level))
+        self.income = None
+        self.world[exporter].invalidate_exporters()
+        self.reserve -= cost
+        self.changes += 1
+        if self.log is not None:
+            self.log.record(EVENT_BLOCK, exporter, cost)
+
+    def unblock(self, exporter):
+        connection = self.imports[exporter]
+        connection.blocked = False
+        self.world[exporter].markets += connection.level
+        self.income = None
+        self.world[exporter].invalidate_exporters()
+        self.changes += 1
+        if self.log is not None:
+            self.log.record(EVENT_UNBLOCK, exporter)
 
     def purchase_mine(self, turn=-1):
         mine_cost = 7
         first_mine_cost = 3
 
         if turn >= 0:
-            income_percentage = min((0.01 * (100 - turn) * 3), 1)
-            mines_purchased = self.reserve * income_percentage // mine_cost
+            mines_purchased = self.reserve * mine_budget(turn) // mine_cost
 
             if self.mines > 1:
-                self.reserve -= mines_purchased * mine_cost
-                self.mines += mines_purchased
+                self.add_mines(mines_purchased, mines_purchased * mine_cost)
             elif self.reserve >= first_mine_cost:
-                self.reserve -= first_mine_cost
-                self.mines += 1
+                self.add_mines(1, first_mine_cost)
         else:
             while True:
                 try:
                     if (self.mines == 0 and self.reserve < first_mine_cost) or (self.mines and self.reserve < mine_cost):
-                        print('You can\'t afford any mines')
+                        self.seat.tell('You can\'t afford any mines')
                         break
-                    mines_purchased = int(input('How many mines would you like to purchase? '))
+                    mines_purchased = int(self.seat.ask('How many mines would you like to purchase? '))
                     if self.mines == 0:
                         if self.reserve >= (mines_purchased - 1) * mine_cost + first_mine_cost:
-                            self.reserve -= (mines_purchased - 1) * mine_cost + first_mine_cost
-                            self.mines += mines_purchased
+                            self.add_mines(mines_purchased, (mines_purchased - 1) * mine_cost + first_mine_cost)
                             break
                         else:
-                            print('You can\'t afford that.')
+                            self.seat.tell('You can\'t afford that.')
                     else:
                         if self.reserve >= mines_purchased * mine_cost:
-                            self.reserve -= mines_purchased * mine_cost
-                            self.mines += mines_purchased
+                            self.add_mines(mines_purchased, mines_purchased * mine_cost)
                             break
                         else:
-                            print('You can\'t afford that.')
+                            self.seat.tell('You can\'t afford that.')
 
                 except ValueError:
-                    print('Please enter a number.')
+                    self.seat.tell('Please enter a number.')
 
     def purchase_town(self):
         town_cost = self.power_level
@@ -155,84 +1044,52 @@ class Countries:
         if self.reserve >= town_cost and self.power_level == len(POWER_LEVELS) and self.player:
             while True:
                 try:
-                    towns_purchased = int(input('How many towns would you like to purchase? '))
+                    towns_purchased = int(self.seat.ask('How many towns would you like to purchase? '))
                     if towns_purchased * town_cost <= self.reserve:
-                        self.reserve -= towns_purchased * town_cost
-                        self.towns += towns_purchased
+                        self.add_towns(towns_purchased, towns_purchased * town_cost)
                         break
                     else:
-                        print('You can\'t afford that')
+                        self.seat.tell('You can\'t afford that')
 
                 except ValueError:
-                    print('Please enter a number')
+                    self.seat.tell('Please enter a number')
 
         elif self.reserve >= town_cost:
-            self.reserve -= town_cost
-            self.towns += 1
+            self.add_towns(1, town_cost)
             if self.player:
-                print('Town purchased')
+                self.seat.tell('Town purchased')
         elif self.player:
-            print('You can\'t afford that!')
+            self.seat.tell('You can\'t afford that!')
 
     def purchase_connection(self, random_importer=False):
-        max_connection_level = 3
         first_connection_cost = 3
 
         if random_importer:
-            importer = random.choice([j for j in range(COUNTRY_COUNT) if j != self.name])
+            importer = self.rng.choice([j for j in range(len(self.world)) if j != self.name])
         elif self.player:
             while True:
                 try:
-                    importer = int(input(f'Choose a connection: '))
-                    if 0 <= importer < len(country_list) and importer != self.name:
+                    importer = int(self.seat.ask(f'Choose a connection: '))
+                    if 0 <= importer < len(self.world) and importer != self.name:
                         break
                     else:
-                        print('Index out of range.')
+                        self.seat.tell('Index out of range.')
                 except ValueError:
-                    print('Please enter a number.')
+                    self.seat.tell('Please enter a number.')
         else:
-            reward = (-1, None)
-            imports, blockaded, reward_list = [], [], []
-
-            for country in country_list:
-                for connection in country.connections:
-                    if connection[0] == self.name and not connection[2]:
-                        imports.append(connection[0])
-                        blockaded.append(connection[2])
-
-            for importer_i, importer in enumerate(country_list):
-                if importer_i == self.name:
-                    continue
-
-                connection_level = 1
-                for c in self.connections:
-                    if c[0] == importer_i:
-                        connection_level = c[1] + 1
-                        break
-
-                if connection_level <= 3:
-                    value = (4 * math.floor((importer.towns + importer.markets) / max(1, 6 - connection_level))) - connection_level * 6
-                    value += PERCEPTION_VALUE * self.perception[importer_i]
-                    if value >= reward[0]:
-                        if value > reward[0]:
-                            reward_list = []
-                            reward = (value, importer.name)
-                        reward_list.append((value, importer.name))
-
-            if reward[1] is None:
+            reward_list = self.best_targets()
+            if not reward_list:
                 return
-            importer = reward_list[random.randint(0, len(reward_list) - 1)][1]
+            importer = reward_list[self.rng.randint(0, len(reward_list) - 1)]
 
         connection_found = False
         connection_level = 1
-        found_connection = None
 
         for connection in self.connections:
-            if connection[0] == importer:
-                if connection[1] < max_connection_level:
-                    found_connection = connection
+            if connection.importer == importer:
+                if connection.level < MAX_CONNECTION_LEVEL:
                     connection_found = True
-                    connection_level = connection[1] + 1
+                    connection_level = connection.level + 1
                 else:
                     return
                 break
@@ -240,118 +1097,144 @@ class Countries:
         connection_cost = 6 * connection_level
         cost = first_connection_cost if len(self.connections) == 0 else connection_cost
         if self.reserve >= cost:
-            if connection_found:
-                found_connection[1] += 1
-
-            elif len(self.connections) + 1 <= MAX_CONNECTIONS[self.power_level - 1]:
-                # [country_index, connection_level, is_blocked]
-                self.connections.append([country_list[importer].name, 1, False])
-
-            elif self.player:
-                print(f'You maxed out connection for power level {self.power_level}')
+            connected = connection_found or len(self.connections) + 1 <= MAX_CONNECTIONS[self.power_level - 1]
+            if not connected and self.player:
+                self.seat.tell(f'You maxed out connection for power level {self.power_level}')
 
-            # Starting bonus for importer, also allows for an instant blockade (blockade cost = 3)
-            country_list[importer].reserve += 3
-            country_list[importer].life_time_earning += 3
-            country_list[importer].markets += 1
-
-            self.reserve -= cost
+            self.connect(importer, cost, connected)
 
         elif self.player:
-            print('You can\'t afford a connection!')
+            self.seat.tell('You can\'t afford a connection!')
+
+    def target_value(self, importer_i):
+        connection = self.world[importer_i].imports.get(self.name)
+        connection_level = 1 if connection is None else connection.level + 1
+        if importer_i == self.name or connection_level > MAX_CONNECTION_LEVEL:
+            return None
+
+        importer = self.world[importer_i]
+        value = (4 * ((importer.towns + importer.markets) // CONNECTION_DIVISORS[connection_level])) - connection_level * 6
+        return value + PERCEPTION_VALUE * self.perception.get(importer_i, 0)
+
+    def best_targets(self):
+        # Importers with the best target_value as a BestTargets, empty when the best doesn't beat -1. Only the
+        # countries this one has a connection to or a perception of are scored here, the others are taken from the
+        # World's ranking
+        related = set(self.perception)
+        related.update(connection.importer for connection in self.connections)
+        best, ties = -1, []
+        for j in sorted(related):
+            value = self.target_value(j)
+            if value is not None and value >= best:
+                if value > best:
+                    best, ties = value, []
+                ties.append(j)
+
+        related.add(self.name)
+        top = self.world.top_ranked(related)
+        if top is not None:
+            rank, ranked, skipped = top
+            value = 4 * rank - 6
+            if value > best:
+                return BestTargets([], ranked, skipped) if value > -1 else BestTargets([])
+            if value == best and best > -1:
+                return BestTargets(ties, ranked, skipped)
+        return BestTargets(ties if best > -1 else [])
 
     def remove_connection(self, random_importer=False):
         if not self.connections:
             if self.player:
-                print('You don\'t have any connections to remove')
+                self.seat.tell('You don\'t have any connections to remove')
             return
 
         if random_importer:
-            self.connections.pop(random.randint(0, len(self.connections) - 1))
+            self.drop_connection(self.connections[self.rng.randint(0, len(self.connections) - 1)])
         elif self.player:
             while True:
                 try:
-                    importer = int(input(f'Choose a connection to remove (by index): '))
+                    importer = int(self.seat.ask(f'Choose a connection to remove (by index): '))
                     if 1 <= importer <= len(self.connections):
-                        self.connections.pop((importer-1))
+                        self.drop_connection(self.connections[importer - 1])
                         break
                     else:
-                        print('Index out of range.')
+                        self.seat.tell('Index out of range.')
                 except ValueError:
-                    print('Please enter a number.')
+                    self.seat.tell('Please enter a number.')
         else:
-            connector_names = {conn[0] for conn in self.connections}
-            best_cut_score, fallback_cut_score = float('-inf'), float('-inf')
-            best_cut_list, fallback_cut_list = [], []
+            best_cut_list, fallback_cut_list = self.cut_lists()
+            selected = self.world[best_cut_list[self.rng.randint(0, len(best_cut_list) - 1)]] if len(best_cut_list) else (
+                self.world)[fallback_cut_list[self.rng.randint(0, len(fallback_cut_list) - 1)]]
+            if not selected:
+                return
+            for connection in [c for c in self.connections if c.importer == selected]:
+                self.drop_connection(connection)
 
-            for connection in self.connections:
-                country = country_list[connection[0]]
+    def cut_lists(self):
+        # Tie lists of the AI remove_connection
+        connector_names = {conn.importer for conn in self.connections}
+        best_cut_score, fallback_cut_score = float('-inf'), float('-inf')
+        best_cut_list, fallback_cut_list = [], []
 
-                estimated_income = (math.floor(country.mines / 2)
-                                    + math.floor((self.towns + self.markets) / max(1, 6 - connection[1]))
-                                    + connection[1] * 3)  # Add value to AI losing from connection
+        for connection in self.connections:
+            country = self.world[connection.importer]
 
-                estimated_income += -PERCEPTION_VALUE * self.perception[country_list[connection[0]].name]
+            estimated_income = (country.mines // 2
+                                + (self.towns + self.markets) // CONNECTION_DIVISORS[connection.level]
+                                + connection.level * 3)  # Add value to AI losing from connection
 
-                if country.name not in connector_names:
-                    if estimated_income >= best_cut_score:
-                        if estimated_income == best_cut_score:
-                            best_cut_list = []
-                        else:
-                            best_cut_score = estimated_income
-                        best_cut_list.append(country.name)
-                else:
-                    if estimated_income >= fallback_cut_score:
-                        if estimated_income == best_cut_score:
-                            fallback_cut_list = []
-                        else:
-                            fallback_cut_score = estimated_income
-                        fallback_cut_list.append(country.name)
+            estimated_income += -PERCEPTION_VALUE * self.perception.get(connection.importer, 0)
 
-            selected = country_list[best_cut_list[random.randint(0, len(best_cut_list) - 1)]] if len(best_cut_list) else (
-                country_list)[fallback_cut_list[random.randint(0, len(fallback_cut_list) - 1)]]
-            if not selected:
-                return
-            self.connections = [c for c in self.connections if c[0] != selected]
+            if country.name not in connector_names:
+                if estimated_income >= best_cut_score:
+                    if estimated_income == best_cut_score:
+                        best_cut_list = []
+                    else:
+                        best_cut_score = estimated_income
+                    best_cut_list.append(country.name)
+            else:
+                if estimated_income >= fallback_cut_score:
+                    if estimated_income == best_cut_score:
+                        fallback_cut_list = []
+                    else:
+                        fallback_cut_score = estimated_income
+                    fallback_cut_list.append(country.name)
+
+        return best_cut_list, fallback_cut_list
 
     def purchase_blockade(self, random_importer=False):  # Smart by default
         blockade_cost = 3
-        imports = []
 
         if self.reserve >= blockade_cost:
-            for country in country_list:
-                for connection in country.connections:
-                    if connection[0] == self.name and not connection[2]:
-                        imports.append((country, connection))
+            imports = self.incoming_connections(blocked=False)
 
             if imports:
                 if random_importer:
-                    target_country, selected_connection = random.choice(imports)
+                    target_country, selected_connection = self.rng.choice(imports)
                 elif self.player:
                     while True:
                         for j, (country, connection) in enumerate(imports, 1):
-                            print(f"{j}. Player {country.name} (level {connection[1]})")
+                            self.seat.tell(f"{j}. Player {country.name} (level {connection.level})")
                         try:
-                            index = int(input("Enter the index of the country you want to blockade: "))
+                            index = int(self.seat.ask("Enter the index of the country you want to blockade: "))
                             if 1 <= index <= len(imports):
                                 target_country, selected_connection = imports[index-1]
                                 break
                             else:
-                                print('Index out of range.')
+                                self.seat.tell('Index out of range.')
                         except ValueError:
-                            print('Please enter a number.')
+                            self.seat.tell('Please enter a number.')
                 else:
-                    connector_names = {conn[0] for conn in self.connections}
+                    connector_names = {conn.importer for conn in self.connections}
                     best_cut, fallback_cut = None, None
                     fallback_cut_score, best_cut_score = float('-inf'), float('-inf')
                     best_cut_list, fallback_cut_list = [], []
 
                     for country, connection in imports:
-                        estimated_income = (math.floor(country.mines / 2)
-                                            + math.floor((self.towns + self.markets) / max(1, 6 - connection[1]))
-                                            + connection[1] * 3)  # Add value to AI losing from connection
+                        estimated_income = (country.mines // 2
+                                            + (self.towns + self.markets) // CONNECTION_DIVISORS[connection.level]
+                                            + connection.level * 3)  # Add value to AI losing from connection
 
-                        estimated_income += -PERCEPTION_VALUE * self.perception[country.name]
+                        estimated_income += -PERCEPTION_VALUE * self.perception.get(country.name, 0)
 
                         if country.name not in connector_names:
                             if estimated_income >= best_cut_score:
@@ -370,56 +1253,53 @@ class Countries:
                                     fallback_cut_score = estimated_income
                                 fallback_cut_list.append(fallback_cut)
 
-                    selected = best_cut_list[random.randint(0, len(best_cut_list) - 1)] if len(best_cut_list) else (
-                        fallback_cut_list[random.randint(0, len(fallback_cut_list) - 1)])
+                    selected = best_cut_list[self.rng.randint(0, len(best_cut_list) - 1)] if len(best_cut_list) else (
+                        fallback_cut_list[self.rng.randint(0, len(fallback_cut_list) - 1)])
                     if not selected:
                         return
                     target_country, selected_connection = selected
 
-                selected_connection[2] = True
-                target_country.markets = max(0, (target_country.markets - selected_connection[1]))
-                self.reserve -= blockade_cost
+                self.block(target_country.name, blockade_cost)
 
             elif self.player:
-                print('You have no connections')
+                self.seat.tell('You have no connections')
 
         elif self.player:
-            print('You don\'t have enough money')
+            self.seat.tell('You don\'t have enough money')
 
     def remove_blockade(self, random_removal=False):  # Smart by default
-        blocked = [(country, connection) for country in country_list for connection in country.connections if
-                   connection[0] == self.name and connection[2]]
+        blocked = self.incoming_connections(blocked=True)
 
         if blocked:
             if random_removal:
-                target_country, selected_connection = random.choice(blocked)
+                target_country, selected_connection = self.rng.choice(blocked)
             elif self.player:
-                print("Choose a blockade to remove:")
+                self.seat.tell("Choose a blockade to remove:")
                 for j, (country, connection) in enumerate(blocked, 1):
-                    print(f"{j}. Player {country.name} (level {connection[1]}{' and BLOCKED' if connection[2] else ''})")
+                    self.seat.tell(f"{j}. Player {country.name} (level {connection.level}{' and BLOCKED' if connection.blocked else ''})")
 
                 while True:
                     try:
-                        index = int(input("Enter the index of the blockade to remove: "))
+                        index = int(self.seat.ask("Enter the index of the blockade to remove: "))
                         if 1 <= index <= len(blocked):
                             target_country, selected_connection = blocked[index - 1]
-                            print(f"Removed the blockade on player {target_country.name}")
+                            self.seat.tell(f"Removed the blockade on player {target_country.name}")
                             break
                         else:
-                            print("Index out of range.")
+                            self.seat.tell("Index out of range.")
                     except ValueError:
-                        print("Please enter a valid number.")
+                        self.seat.tell("Please enter a valid number.")
             else:
-                connector_names = {conn[0] for conn in self.connections}
+                connector_names = {conn.importer for conn in self.connections}
                 best_blocked_score, fallback_blocked_score = float('inf'), float('-inf')
                 best_blocked_list, fallback_blocked_list = [], []
 
                 for country, connection in blocked:
-                    estimated_income = (math.floor(country.mines / 2)
-                                        + math.floor((self.towns + self.markets) / max(1, 6 - connection[1]))
-                                        + connection[1] * 3)  # Add value to AI losing from connection
+                    estimated_income = (country.mines // 2
+                                        + (self.towns + self.markets) // CONNECTION_DIVISORS[connection.level]
+                                        + connection.level * 3)  # Add value to AI losing from connection
 
-                    estimated_income += PERCEPTION_VALUE * self.perception[country.name]
+                    estimated_income += PERCEPTION_VALUE * self.perception.get(country.name, 0)
 
                     if country.name not in connector_names:
                         if estimated_income > best_blocked_score:
@@ -436,28 +1316,23 @@ class Countries:
                             fallback_blocked_list.append((country, connection))
 
                 if best_blocked_list:
-                    selected = random.choice(best_blocked_list)
+                    selected = self.rng.choice(best_blocked_list)
                 elif fallback_blocked_list:
-                    selected = random.choice(fallback_blocked_list)
+                    selected = self.rng.choice(fallback_blocked_list)
                 else:
                     return
                 target_country, selected_connection = selected
 
-            selected_connection[2] = False
-            target_country.markets += selected_connection[1]
+            self.unblock(target_country.name)
 
         elif self.player:
-            print('You have no blockades')
+            self.seat.tell('You have no blockades')
 
     def do_nothing(self):
         pass
 
     def defensive_block(self):
-        incoming = 0
-        for country in country_list:
-            for connection in country.connections:
-                if connection[0] == self.name and not connection[2]:
-                    incoming += 1
+        incoming = sum(1 for connection in self.imports.values() if not connection.blocked)
 
         if incoming > 5 and self.reserve < 100:
             for _ in range(incoming - 4):
@@ -477,44 +1352,203 @@ class Countries:
         return self.reserve >= self.power_level or self.reserve >= (3 if self.mines == 0 else 7) or self.reserve >= 3
 
     def get_state(self, turn):
-        max_money_level = 8
-        max_turn_level = 10
-        turn_level_incr = 20
+        return discretize_state(self.power_level, self.reserve, len(self.connections), turn)
 
-        money_level = min(int(max(0, self.reserve) ** (1/2) / 5) + 1, max_money_level)
-        turn_level = min(turn // turn_level_incr, max_turn_level - 1) + 1
+    def choose_action(self, turn):
+        return self.q_table.select_action(self.get_state(turn), self.rng)
 
-        return self.power_level, money_level, len(self.connections), turn_level
+    def execute_actions(self, turn):
+        # Returns how many passes its loop made, counting the ones repeat_greedy made in bulk
+        passes = 0
+        action_index = None
+        while self.can_afford_anything():
+            if action_index is None:
+                action_index = self.choose_action(turn)
+                passes += 1
+            if action_index == DO_NOTHING:
+                break
+            elif action_index == PURCHASE_MINE:
+                self.purchase_mine(turn)
+            else:
+                getattr(self, ACTIONS[action_index])()
+            if BULK_REPEATS:
+                action_index, repeated = self.repeat_greedy(turn)
+                passes += repeated
+            else:
+                action_index = None
 
-    def choose_action(self, turn):
-        num_of_actions = len(self.actions)
+        self.defensive_block()
+        self.find_power_level()
+        return passes
+
+    def repeat_greedy(self, turn):
+        # The passes of the execute_actions loop after an action, for as long as nothing changes: they all see the
+        # same state, so they choose its greedy action unless they explore. They skip the state and Q-table lookups,
+        # no-ops are repeated by drawing what they would draw, and a run of towns or of connection bonuses is bought
+        # at once. The same random numbers are drawn as in those passes. Returns the action the next pass has already
+        # chosen, or None when the loop has to choose it (something changed, or this country can't afford anything),
+        # and how many passes chose their action here. They are all visits of the state for the Q-table's telemetry
+        if not self.can_afford_anything():
+            return None, 0
+        q_table = self.q_table
         state = self.get_state(turn)
+        index = q_table.index(state)
+        present = q_table.present[index]
+        q_table.present[index] = 1
+        action, passes = self.repeat_passes(turn, state, q_table.greedy[index])
+        if q_table.telemetry is not None and passes:
+            q_table.telemetry.visit(index, present, passes)
+        return action, passes
+
+    def repeat_passes(self, turn, state, action_index):
+        # repeat_greedy's passes, action_index being the greedy action of state
+        q_table, rng = self.q_table, self.rng
+        epsilon = q_table.epsilon
+        passes = 0
+        while True:
+            passes += 1
+            if rng.random() < epsilon:
+                return rng.randint(0, q_table.num_of_actions - 1), passes
+            if action_index == DO_NOTHING:
+                return action_index, passes
+
+            changes = self.changes
+            if action_index == PURCHASE_TOWN and self.power_level <= self.reserve < EXACT_FLOATS:
+                towns, action = self.repeat_purchase(turn, state, self.power_level, 0)
+                self.add_towns(towns, towns * self.power_level)
+                # every purchase after the first is a pass, and so is the one that explored
+                return action, passes + towns - (action is None)
+            elif action_index == PURCHASE_CONNECTION and (bonus := self.bulk_bonus()) is not None:
+                importer, cost = bonus
+                bonuses, action = self.repeat_purchase(turn, state, cost, 1)
+                self.connect(importer, cost, False, bonuses)
+                return action, passes + bonuses - (action is None)
+            elif action_index == PURCHASE_MINE:
+                self.purchase_mine(turn)
+            else:
+                getattr(self, ACTIONS[action_index])()
+
+            if self.changes != changes:
+                return None, passes
+            choices = self.no_op_choices(action_index)
+            if choices is not None:
+                while rng.random() >= epsilon:
+                    passes += 1
+                    if choices:
+                        rng.randint(0, choices - 1)
+                return rng.randint(0, q_table.num_of_actions - 1), passes + 1
+
+    def repeat_count(self, turn, state, cost):
+        # Most purchases at cost in a row whose last one is still made in this state and affordable (the power level
+        # only changes at the end of the turn), at least 1
+        reserve = self.reserve
+        low, high = 1, int(reserve // cost)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if discretize_state(self.power_level, reserve - (middle - 1) * cost, len(self.connections), turn) == state:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def repeat_purchase(self, turn, state, cost, choices):
+        # The purchase of the pass that just started is made again by every following pass that doesn't explore,
+        # up to repeat_count. choices is the size of the tie the purchase draws from, 0 when it doesn't draw.
+        # Returns how many purchases were made and the action of the pass that explored, if one did
+        most = self.repeat_count(turn, state, cost)
+        purchases = 0
+        while True:
+            if choices:
+                self.rng.randint(0, choices - 1)
+            purchases += 1
+            if purchases == most:
+                return purchases, None
+            if self.rng.random() < self.q_table.epsilon:
+                return purchases, self.rng.randint(0, self.q_table.num_of_actions - 1)
+
+    def bulk_bonus(self):
+        # (importer, cost) when purchase_connection can only buy the starting bonus of a new connection and picks
+        # the same importer every time: the only best target, not connected yet, while this country is maxed out on
+        # connections (its score only goes up with the markets it gets, so it stays the only best one). None otherwise,
+        # or when a bulk purchase wouldn't be exact
+        ties = self.best_targets()
+        if (len(ties) != 1 or self.world[ties[0]].imports.get(self.name) is not None
+                or len(self.connections) + 1 <= MAX_CONNECTIONS[self.power_level - 1]):
+            return None
+        importer = self.world[ties[0]]
+        cost = 6 if self.connections else 3
+        if not (cost <= self.reserve < EXACT_FLOATS and abs(importer.reserve) < EXACT_FLOATS
+                and importer.life_time_earning < EXACT_FLOATS):
+            return None
+        return importer.name, cost
+
+    def no_op_choices(self, action_index):
+        # Size of the tie an action that just changed nothing draws from when it's repeated in the same state
+        # (0 when it doesn't draw), or None when a repeat might change something
+        if action_index in DRAWLESS_NO_OPS:
+            return 0
+        if action_index == REMOVE_CONNECTION:  # never removes anything, see ArrayWorld.remove_connection
+            best_cut_list, fallback_cut_list = self.cut_lists() if self.connections else ([], [])
+            return len(best_cut_list) or len(fallback_cut_list)
+        if action_index == PURCHASE_CONNECTION:  # a no-op when none of the best targets is affordable
+            ties = self.best_targets()
+            costs = [6 if self.connections else 3] if len(ties.ranked) > len(ties.skipped) else []
+            for importer in ties.related:
+                connection = self.world[importer].imports.get(self.name)
+                costs.append(6 * (1 if connection is None else connection.level + 1) if self.connections else 3)
+            if all(self.reserve < cost for cost in costs):
+                return len(ties)
+        return None
+
+    def play_greedy(self, turn):
+        # Turn of a frozen policy (self.q_table is a GreedyPolicy): always the greedy action, without exploration,
+        # learning or rewards. An action that changed nothing would be chosen again forever, so it ends the turn.
+        # Runs of towns and of connection bonuses are bought at once, as in repeat_greedy
+        policy = self.q_table
+        while self.can_afford_anything():
+            state = self.get_state(turn)
+            action_index = policy.action(state)
+            if action_index == DO_NOTHING:
+                break
 
-        if state not in q_table or len(q_table[state]) != num_of_actions:
-            q_table[state] = [0] * num_of_actions
+            changes = self.changes
+            if action_index == PURCHASE_TOWN and self.power_level <= self.reserve < EXACT_FLOATS:
+                towns = self.repeat_count(turn, state, self.power_level)
+                self.add_towns(towns, towns * self.power_level)
+            elif action_index == PURCHASE_CONNECTION and (bonus := self.bulk_bonus()) is not None:
+                importer, cost = bonus
+                self.connect(importer, cost, False, self.repeat_count(turn, state, cost))
+            elif action_index == PURCHASE_MINE:
+                self.purchase_mine(turn)
+            else:
+                getattr(self, ACTIONS[action_index])()
+            if self.changes == changes:
+                break
 
-        if random.random() < epsilon:
-            return random.randint(0, num_of_actions - 1)
-        else:
-            # lambda function loops through all the q_table values to find the highest one
-            return max(range(num_of_actions), key=lambda j: q_table[state][j])
+        self.defensive_block()
+        self.find_power_level()
 
-    def execute_actions(self, turn):
+    def play_lookahead(self, turn):
+        # Turn of a Lookahead (self.q_table): every action is the one its rollouts score best, until that is to do
+        # nothing or changes nothing
+        lookahead = self.q_table
         while self.can_afford_anything():
-            action_index = self.choose_action(turn)
-            if action_index == self.actions.index(self.do_nothing):
+            action_index = lookahead.action(self, turn)
+            if action_index == DO_NOTHING:
                 break
-            elif action_index == self.actions.index(self.purchase_mine):
+
+            changes = self.changes
+            if action_index == PURCHASE_MINE:
                 self.purchase_mine(turn)
             else:
-                self.actions[action_index]()
+                getattr(self, ACTIONS[action_index])()
+            if self.changes == changes:
+                break
 
         self.defensive_block()
         self.find_power_level()
 
-    # Q(s,a)←Q(s,a)+α⋅[r+γ⋅a′maxQ(s′,a′)−Q(s,a)]
     def q_learning(self, turn):
-        num_of_actions = len(self.actions)
         old_state = self.get_state(turn)
         pre_income = self.generate_money(False)
         pre_connections = len(self.connections)
@@ -527,101 +1561,1538 @@ class Countries:
         connection_gain = (len(self.connections) - pre_connections)
 
         reward = 10 * (post_income - pre_income) + 7 * connection_gain + 12 * self.mines
-
-        if old_state not in q_table or len(q_table[old_state]) != num_of_actions:
-            q_table[old_state] = [0] * num_of_actions
-        if new_state not in q_table or len(q_table[new_state]) != num_of_actions:
-            q_table[new_state] = [0] * num_of_actions
-
-        old_value = q_table[old_state][action_index]
-        future_estimate = max(q_table[new_state])
-        q_table[old_state][action_index] = old_value + alpha * (reward + gamma * future_estimate - old_value)
+        self.q_table.update(old_state, action_index, reward, new_state)
 
     def competitor_info(self):
-        print('Here is a list of nations with their information:')
-        for country in country_list:
+        self.seat.tell('Here is a list of nations with their information:')
+        for country in self.world:
             if self == country:
-                print(f'Player {country.name} (YOU) - Town count: {country.towns + country.markets}  '
-                      f'({self.towns} towns and {self.markets} markets), Mine count: '
-                      f'{country.mines}, Power level: {country.power_level}, Reserve: {country.reserve}, Connections: '
-                      f'{[f'Player {connection[0]} {'(YOU) (' if connection[0] == self.name else ' ('}level {connection[1]}'
-                          f'{' and BLOCKED)' if connection[2] else ')'}' for connection in country.connections]}')
+                self.seat.tell(f'Player {country.name} (YOU) - Town count: {country.towns + country.markets}  '
+                               f'({self.towns} towns and {self.markets} markets), Mine count: '
+                               f'{country.mines}, Power level: {country.power_level}, Reserve: {country.reserve}, Connections: '
+                               f'{[f'Player {connection.importer} {'(YOU) (' if connection.importer == self.name else ' ('}level {connection.level}'
+                                   f'{' and BLOCKED)' if connection.blocked else ')'}' for connection in country.connections]}')
             else:
-                print(f'Player {country.name} - Town count: {country.towns + country.markets}, Mine count: {country.mines}, Power level: '
-                      f'{country.power_level}, Connections: {[f'Player {connection[0]} '
-                                                             f'{'(YOU) (' if connection[0] == self.name else ' ('}level {connection[1]}'
-                                                              f'{' and BLOCKED)' if connection[2] else ')'}' 
-                                                              for connection in country.connections]}')
+                self.seat.tell(f'Player {country.name} - Town count: {country.towns + country.markets}, Mine count: {country.mines}, Power level: '
+                               f'{country.power_level}, Connections: {[f'Player {connection.importer} '
+                                                                      f'{'(YOU) (' if connection.importer == self.name else ' ('}level {connection.level}'
+                                                                       f'{' and BLOCKED)' if connection.blocked else ')'}' 
+                                                                       for connection in country.connections]}')
 
     def play_turn(self, turn, total_turns):
-        print(f'\nCurrent turn: {turn + 1} / {total_turns}')
+        self.seat.tell(f'\nCurrent turn: {turn + 1} / {total_turns}')
         while True:
-            print('\nPurchase a Mine, Purchase a Town, Purchase a Connection, Purchase a Blockade, '
-                  'Remove a Connection, Remove a Blockade, End Your Turn')
+            self.seat.tell('\nPurchase a Mine, Purchase a Town, Purchase a Connection, Purchase a Blockade, '
+                           'Remove a Connection, Remove a Blockade, End Your Turn')
             try:
                 self.find_power_level()
 
-                print(f'Your Reserve: {self.reserve} coins          Your power level: {self.power_level}')
-                print(f'Your Connections ({len(self.connections)}): {[f'Player {connection[0]} '
-                                                                      f'(level {connection[1]}{' and BLOCKED)' if connection[2] else ')'}'
-                                                                      for connection in self.connections]}')
-                action = int(input(f'Player {self.name}, choose an action from this list by entering it\'s position: '))
+                self.seat.tell(f'Your Reserve: {self.reserve} coins          Your power level: {self.power_level}')
+                self.seat.tell(f'Your Connections ({len(self.connections)}): {[f'Player {connection.importer} '
+                                                                               f'(level {connection.level}{' and BLOCKED)' if connection.blocked else ')'}'
+                                                                               for connection in self.connections]}')
+                action = int(self.seat.ask(f'Player {self.name}, choose an action from this list by entering it\'s position: '))
                 action -= 1
-                if 0 <= action < len(self.actions) - 1:
-                    self.actions[action]()
-                elif action == len(self.actions) - 1:
-                    print(f'\nPLAYER {self.name}, TURN {turn + 1} ENDED\n')
+                if 0 <= action < len(ACTIONS) - 1:
+                    getattr(self, ACTIONS[action])()
+                elif action == len(ACTIONS) - 1:
+                    self.seat.tell(f'\nPLAYER {self.name}, TURN {turn + 1} ENDED\n')
                     break
                 else:
-                    print('Index out of range.')
+                    self.seat.tell('Index out of range.')
             except ValueError:
-                print('Please enter a number.')
+                self.seat.tell('Please enter a number.')
+
+
+class ArrayWorld:
+    # Same rules as a country_list of AI Countries, with the whole world stored as arrays.
+    # levels[exporter, importer] is the connection level (0 = no connection) and blocked[exporter, importer]
+    # its blockade flag, so every per-country pass works on a whole row or column at once
+
+    # (name, dtype) of the arrays a world is stored in, one value per country...
+    COUNTRY_ARRAYS = (('towns', 'int64'), ('markets', 'int64'), ('mines', 'float64'), ('power_level', 'int64'),
+                      ('reserve', 'float64'), ('life_time_earning', 'float64'), ('connection_count', 'int64'))
+    # ...and one per pair of countries. opened is the creation order of each connection, so connections are listed
+    # in the order Countries appends them
+    PAIR_ARRAYS = (('perception', 'int64'), ('levels', 'int64'), ('blocked', 'bool'), ('opened', 'int64'))
+
+    def __init__(self, count=COUNTRY_COUNT, q_table=None, rngs=None, arrays=None):
+        # arrays can supply those arrays by name instead of allocating them, e.g. views into the arrays of a BatchEnv
+        if np is None:
+            raise ImportError('The array engine requires numpy')
+        if PLAYERS:
+            raise ValueError('The array engine only simulates AI countries')
+
+        self.count = count
+        for name, dtype in self.COUNTRY_ARRAYS:
+            setattr(self, name, arrays[name] if arrays else np.zeros(count, dtype=dtype))
+        for name, dtype in self.PAIR_ARRAYS:
+            setattr(self, name, arrays[name] if arrays else np.zeros((count, count), dtype=dtype))
+        self.reset(q_table, rngs)
+
+    def reset(self, q_table=None, rngs=None):
+        # Back to the start of a game, in place, so new_world can reuse the arrays for the next one
+        self.q_table = q_table
+        self.rngs = rngs or [random] * self.count  # random stream of each country, as Countries.rng
+        self.log = None  # ReplayLog, as Countries.log
+        for name, _ in self.COUNTRY_ARRAYS + self.PAIR_ARRAYS:
+            getattr(self, name).fill(0)
+        self.power_level.fill(1)
+        self.opened_total = 0
+
+    def rng_streams(self):
+        return list({id(rng): rng for rng in self.rngs}.values())
+
+    def snapshot(self, rngs=True):
+        # As World.snapshot, a copy of every array
+        arrays = {name: getattr(self, name).copy() for name, _ in self.COUNTRY_ARRAYS + self.PAIR_ARRAYS}
+        rng_states = [rng.getstate() for rng in self.rng_streams()] if rngs else None
+        return WorldSnapshot(self.count, 'array', (arrays, self.opened_total), rng_states)
+
+    def restore(self, snapshot, rngs=True):
+        if snapshot.engine != 'array' or snapshot.count != self.count:
+            raise ValueError(f'Can\'t restore a snapshot of {snapshot.count} countries ({snapshot.engine} engine) '
+                             f'into an array world of {self.count}')
+        arrays, self.opened_total = snapshot.data
+        for name, values in arrays.items():
+            np.copyto(getattr(self, name), values)
+        if rngs and snapshot.rng_states is not None:
+            restore_rng_states(self.rng_streams(), snapshot.rng_states)
+
+    def __repr__(self):
+        return '[' + ', '.join(
+            f"\n{i} = Towns: {self.towns[i]} + {self.markets[i]} ({self.power_level[i]}), Mines: {self.mines[i]}, "
+            f"Connections: {self.connections(i)}, Money: {self.reserve[i]} ({self.life_time_earning[i]})"
+            for i in range(self.count)) + ']'
+
+    def connection_importers(self, i):
+        importers = np.flatnonzero(self.levels[i])
+        return importers[np.argsort(self.opened[i, importers], kind='stable')]
+
+    def connections(self, i):
+        return [[j, int(self.levels[i, j]), bool(self.blocked[i, j])] for j in self.connection_importers(i).tolist()]
+
+    def find_power_level(self, i):
+        self.power_level[i] = bisect.bisect_right(POWER_LEVELS, self.towns[i].item() + self.markets[i].item())
+
+    # The changes a turn makes, as the Countries methods of the same names
+
+    def add_mines(self, i, mines, cost):
+        self.reserve[i] -= cost
+        self.mines[i] += mines
+        if self.log is not None and mines:
+            self.log.record(EVENT_MINES, mines, cost)
+
+    def add_towns(self, i, towns, cost):
+        self.reserve[i] -= cost
+        self.towns[i] += towns
+        if self.log is not None:
+            self.log.record(EVENT_TOWNS, towns, cost)
+
+    def connect(self, i, importer, cost, connected=True, times=1):
+        if connected:
+            if self.levels[i, importer]:
+                self.levels[i, importer] += 1
+            else:
+                self.levels[i, importer] = 1
+                self.blocked[i, importer] = False
+                self.opened[i, importer] = self.opened_total
+                self.opened_total += 1
+                self.connection_count[i] += 1
+
+        self.reserve[importer] += 3 * times
+        self.life_time_earning[importer] += 3 * times
+        self.markets[importer] += times
+
+        self.reserve[i] -= cost * times
+        if self.log is not None:
+            for _ in range(times):
+                self.log.record(EVENT_CONNECTION, importer, cost, connected)
+
+    def disconnect(self, i, importer):
+        self.levels[i, importer] = 0
+        self.blocked[i, importer] = False
+        self.connection_count[i] -= 1
+        if self.log is not None:
+            self.log.record(EVENT_DISCONNECT, importer)
+
+    def block(self, i, exporter, cost):
+        self.blocked[exporter, i] = True
+        self.markets[exporter] = max(0, self.markets[exporter] - self.levels[exporter, i])
+        self.reserve[i] -= cost
+        if self.log is not None:
+            self.log.record(EVENT_BLOCK, exporter, cost)
+
+    def unblock(self, i, exporter):
+        self.blocked[exporter, i] = False
+        self.markets[exporter] += self.levels[exporter, i]
+        if self.log is not None:
+            self.log.record(EVENT_UNBLOCK, exporter)
+
+    def generate_money(self, i, generated=True):
+        levels = self.levels[i]
+        importers = np.flatnonzero((levels > 0) & ~self.blocked[:, i])
+        mines = self.mines[i].item()
+        income = mines + self.power_level[i].item()
+
+        if len(importers):
+            importer_levels = levels[importers]
+            income += len(importers) * (mines // 2)
+            income += ((self.towns[importers] + self.markets[importers]) // CONNECTION_DIVISOR_ARRAY[importer_levels]).sum().item()
+            if generated:
+                self.reserve[importers] -= importer_levels
+
+        if generated:
+            self.reserve[i] += income
+            self.life_time_earning[i] += income
+        else:
+            return income
+
+    def find_perception(self, i):
+        incoming, outgoing = self.levels[:, i], self.levels[i]
+        perception = 10 * incoming - np.where(self.blocked[:, i], 15 + 5 * incoming, 0)
+        perception += np.where(outgoing > 0, np.where(self.blocked[i], 5 * outgoing, 10 + 4 * outgoing), 0)
+        perception[self.perception[i] > perception] -= 10
+        self.perception[i] = perception
+
+    def purchase_mine(self, i, turn):
+        mine_cost = 7
+        first_mine_cost = 3
+
+        mines_purchased = self.reserve[i].item() * mine_budget(turn) // mine_cost
+
+        if self.mines[i] > 1:
+            self.add_mines(i, mines_purchased, mines_purchased * mine_cost)
+        elif self.reserve[i] >= first_mine_cost:
+            self.add_mines(i, 1, first_mine_cost)
+
+    def purchase_town(self, i):
+        town_cost = self.power_level[i]
+
+        if self.reserve[i] >= town_cost:
+            self.add_towns(i, 1, town_cost)
+
+    def purchase_connection(self, i):
+        first_connection_cost = 3
+
+        connection_levels = self.levels[i] + 1
+        values = (4 * ((self.towns + self.markets) // CONNECTION_DIVISOR_ARRAY[connection_levels])) - connection_levels * 6
+        values += PERCEPTION_VALUE * self.perception[i]
+        eligible = connection_levels <= MAX_CONNECTION_LEVEL
+        eligible[i] = False
+        if not eligible.any():
+            return
+
+        # Same ties as Countries.purchase_connection: every best value, as long as it beats the starting reward of -1
+        # (a best of exactly -1 never replaces the starting reward's missing importer, so nothing is bought)
+        best = values[eligible].max()
+        if best <= -1:
+            return
+        reward_list = np.flatnonzero(eligible & (values == best))
+        importer = reward_list[self.rngs[i].randint(0, len(reward_list) - 1)].item()
+
+        connection_level = connection_levels[importer].item()
+        connection_cost = 6 * connection_level
+        cost = first_connection_cost if self.connection_count[i] == 0 else connection_cost
+        if self.reserve[i] >= cost:
+            connected = connection_level > 1 or self.connection_count[i] + 1 <= MAX_CONNECTIONS[self.power_level[i] - 1]
+            self.connect(i, importer, cost, bool(connected))
+
+    def remove_connection(self, i):
+        importers = self.connection_importers(i)
+        if not len(importers):
+            return
+
+        levels = self.levels[i, importers]
+        estimated_income = (np.floor(self.mines[importers] / 2)
+                            + (self.towns[i] + self.markets[i]) // CONNECTION_DIVISOR_ARRAY[levels]
+                            + levels * 3)
+        estimated_income -= PERCEPTION_VALUE * self.perception[i, importers]
+
+        # Countries.remove_connection only ever fills its fallback list (each importer is also a connector), with every
+        # running maximum, then compares the chosen Countries object against importer indexes and removes nothing.
+        # The tie-break draw is kept so both engines consume the same random numbers
+        fallback_cut_count = np.count_nonzero(estimated_income >= np.maximum.accumulate(estimated_income))
+        self.rngs[i].randint(0, fallback_cut_count - 1)
+
+    def purchase_blockade(self, i):
+        blockade_cost = 3
+
+        if self.reserve[i] < blockade_cost:
+            return
+        exporters = np.flatnonzero((self.levels[:, i] > 0) & ~self.blocked[:, i])
+        if not len(exporters):
+            return
+
+        levels = self.levels[exporters, i]
+        estimated_income = (np.floor(self.mines[exporters] / 2)
+                            + (self.towns[i] + self.markets[i]) // CONNECTION_DIVISOR_ARRAY[levels]
+                            + levels * 3)
+        estimated_income -= PERCEPTION_VALUE * self.perception[i, exporters]
+        is_connector = self.levels[i, exporters] > 0
+
+        # Tie lists built exactly as in Countries.purchase_blockade
+        best_cut, fallback_cut = None, None
+        fallback_cut_score, best_cut_score = float('-inf'), float('-inf')
+        best_cut_list, fallback_cut_list = [], []
+
+        for exporter, score, connector in zip(exporters.tolist(), estimated_income.tolist(), is_connector.tolist()):
+            if not connector:
+                if score >= best_cut_score:
+                    if score == best_cut_score:
+                        best_cut_list = []
+                    else:
+                        best_cut = exporter
+                        best_cut_score = score
+                    best_cut_list.append(best_cut)
+            else:
+                if score >= fallback_cut_score:
+                    if score == best_cut_score:
+                        fallback_cut_list = []
+                    else:
+                        fallback_cut = exporter
+                        fallback_cut_score = score
+                    fallback_cut_list.append(fallback_cut)
+
+        selected = best_cut_list[self.rngs[i].randint(0, len(best_cut_list) - 1)] if len(best_cut_list) else (
+            fallback_cut_list[self.rngs[i].randint(0, len(fallback_cut_list) - 1)])
+        if selected is None:
+            return
+
+        self.block(i, selected, blockade_cost)
+
+    def remove_blockade(self, i):
+        exporters = np.flatnonzero(self.blocked[:, i])
+        if not len(exporters):
+            return
+
+        # Countries.remove_blockade starts its best score at +inf, so only exporters this country also connects to
+        # (its fallback list) can be picked
+        exporters = exporters[self.levels[i, exporters] > 0]
+        if not len(exporters):
+            return
+
+        levels = self.levels[exporters, i]
+        estimated_income = (np.floor(self.mines[exporters] / 2)
+                            + (self.towns[i] + self.markets[i]) // CONNECTION_DIVISOR_ARRAY[levels]
+                            + levels * 3)
+        estimated_income += PERCEPTION_VALUE * self.perception[i, exporters]
+
+        selected = self.rngs[i].choice(exporters[estimated_income == estimated_income.max()].tolist())
+        self.unblock(i, selected)
+
+    def do_nothing(self, i):
+        pass
+
+    def defensive_block(self, i):
+        incoming = np.count_nonzero((self.levels[:, i] > 0) & ~self.blocked[:, i])
+
+        if incoming > 5 and self.reserve[i] < 100:
+            for _ in range(incoming - 4):
+                self.purchase_blockade(i)
+
+    def can_afford_anything(self, i):
+        reserve = self.reserve[i].item()
+        return reserve >= self.power_level[i] or reserve >= (3 if self.mines[i] == 0 else 7) or reserve >= 3
+
+    def get_state(self, i, turn):
+        return discretize_state(self.power_level[i].item(), self.reserve[i].item(), self.connection_count[i].item(), turn)
+
+    def choose_action(self, i, turn):
+        return self.q_table.select_action(self.get_state(i, turn), self.rngs[i])
+
+    def execute_actions(self, i, turn):
+        # Returns how many passes its loop made
+        passes = 0
+        while self.can_afford_anything(i):
+            action_index = self.choose_action(i, turn)
+            passes += 1
+            if action_index == DO_NOTHING:
+                break
+            elif action_index == PURCHASE_MINE:
+                self.purchase_mine(i, turn)
+            else:
+                getattr(self, ACTIONS[action_index])(i)
+
+        self.defensive_block(i)
+        self.find_power_level(i)
+        return passes
+
+    def q_learning(self, i, turn):
+        old_state = self.get_state(i, turn)
+        pre_income = self.generate_money(i, False)
+        pre_connections = self.connection_count[i].item()
+
+        action_index = self.choose_action(i, turn)
+        self.execute_actions(i, turn)
+
+        new_state = self.get_state(i, turn)
+        post_income = self.generate_money(i, False)
+        connection_gain = (self.connection_count[i].item() - pre_connections)
+
+        reward = 10 * (post_income - pre_income) + 7 * connection_gain + 12 * self.mines[i].item()
+        self.q_table.update(old_state, action_index, reward, new_state)
+
+    def play_turn(self, turn):
+        for i in range(self.count):
+            self.generate_money(i)
+            self.find_perception(i)
+            self.q_learning(i, turn)
+            if self.log is not None:
+                self.log.record(EVENT_END)
+
+
+class TurnProfiler:
+    # Per-phase timers and call counters for the turn loop of both engines, aggregated per game.
+    # enable() swaps the profiled methods of Countries and ArrayWorld for timing wrappers and disable() puts the
+    # originals back, so a profiler that isn't enabled costs nothing. Worlds created while it is enabled get the
+    # wrapped actions. Times are inclusive: execute_actions contains the choose_action and purchases it runs
+    PHASES = ('generate_money', 'find_perception', 'choose_action', 'execute_actions', 'defensive_block',
+              'purchase_connection', 'remove_connection', 'purchase_blockade')
+
+    def __init__(self):
+        self.games = []  # {phase: (seconds, calls)} and the execute_actions histogram of every finished game
+        self.folded = {}  # exclusive seconds per 'phase;nested phase' stack, for flame graphs
+        self._originals = []
+        self._stack = []
+        self._reset_game()
+
+    def _reset_game(self):
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self.loop_iterations = {}  # {power of two bucket: execute_actions calls whose while loop ran that often}
+        self.loop_passes = 0  # passes of the execute_actions while loops, all together
+
+    def enable(self):
+        if self._originals:
+            return
+        for cls in (Countries, ArrayWorld):
+            for phase in self.PHASES:
+                if phase in cls.__dict__:
+                    self._originals.append((cls, phase, cls.__dict__[phase]))
+                    setattr(cls, phase, self._timed(phase, cls.__dict__[phase]))
+
+    def disable(self):
+        for cls, phase, method in self._originals:
+            setattr(cls, phase, method)
+        self._originals = []
+
+    def _timed(self, phase, method):
+        profiler = self
+
+        def timed(*args, **kwargs):
+            frame = [phase, 0.0]  # name and seconds spent in nested phases
+            profiler._stack.append(frame)
+            result = None
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                path = ';'.join(name for name, _ in profiler._stack)
+                profiler._stack.pop()
+                if profiler._stack:
+                    profiler._stack[-1][1] += elapsed
+
+                profiler.seconds[phase] += elapsed
+                profiler.calls[phase] += 1
+                profiler.folded[path] = profiler.folded.get(path, 0) + elapsed - frame[1]
+                if phase == 'execute_actions':
+                    # passes of its while loop, which execute_actions returns
+                    bucket = 1 << (result or 0).bit_length() >> 1
+                    profiler.loop_passes += result or 0
+                    profiler.loop_iterations[bucket] = profiler.loop_iterations.get(bucket, 0) + 1
+
+        timed.__wrapped__ = method
+        return timed
+
+    def game_finished(self):
+        self.games.append(dict(phases={phase: (self.seconds[phase], self.calls[phase]) for phase in self.PHASES},
+                               execute_actions_iterations=dict(sorted(self.loop_iterations.items())),
+                               execute_actions_passes=self.loop_passes))
+        self._reset_game()
+
+    def report(self):
+        totals = {phase: [0.0, 0] for phase in self.PHASES}
+        iterations = {}
+        for game in self.games:
+            for phase, (seconds, calls) in game['phases'].items():
+                totals[phase][0] += seconds
+                totals[phase][1] += calls
+            for bucket, count in game['execute_actions_iterations'].items():
+                iterations[bucket] = iterations.get(bucket, 0) + count
+
+        return dict(phases={phase: dict(seconds=seconds, calls=calls) for phase, (seconds, calls) in totals.items()},
+                    execute_actions_iterations=dict(sorted(iterations.items())),
+                    execute_actions_passes=sum(game['execute_actions_passes'] for game in self.games), games=self.games)
+
+    def write_folded(self, filename):
+        # Collapsed stacks in microseconds, the input format of flamegraph.pl and speedscope
+        with open(filename, 'w') as file:
+            for path, seconds in sorted(self.folded.items()):
+                file.write(f'{path} {round(seconds * 1e6)}\n')
 
 
 GAMES = 100
 TURNS = 100
 DECAY_RATE = 0.99
-highest_lte, highest_reserve, highest_income, total_reserve = 0, 0, 0, 0
-try:
-    for game in range(GAMES):
-        country_list = []
+ENGINE = 'object'  # 'object' plays a country_list of Countries, 'array' plays an ArrayWorld (needs numpy, no PLAYERS)
+WORKERS = 1  # games trained at once by train_parallel, 1 keeps the single-process loop
+SEED = None  # master seed, set it to make a training run reproducible
+
+# Reporter verbosity levels
+SILENT = 0  # nothing
+PROGRESS = 1  # the training percentage
+SUMMARY = 2  # one line per reported game
+DETAILED = 3  # the whole country_list of every reported game, and the Q-table at the end
+VERBOSITY = PROGRESS
+
+
+def describe_countries(country_list):
+    if isinstance(country_list, ArrayWorld):
+        return [dict(name=i, towns=country_list.towns[i].item(), markets=country_list.markets[i].item(),
+                     power_level=country_list.power_level[i].item(), mines=country_list.mines[i].item(),
+                     connections=country_list.connections(i), reserve=country_list.reserve[i].item(),
+                     life_time_earning=country_list.life_time_earning[i].item())
+                for i in range(country_list.count)]
+    return [dict(name=country.name, towns=country.towns, markets=country.markets, power_level=country.power_level,
+                 mines=country.mines,
+                 connections=[[connection.importer, connection.level, connection.blocked]
+                              for connection in country.connections],
+                 reserve=country.reserve,
+                 life_time_earning=country.life_time_earning)
+            for country in country_list]
+
+
+def game_metrics(game, reserves, incomes, q_table, seconds, turns):
+    # Metrics of one finished game, as streamed by Reporter and train. seconds is the wall time of the game (its share
+    # of the round when several games are played at once)
+    ordered = sorted(reserves)
+    middle = len(ordered) // 2
+    telemetry = {} if q_table.telemetry is None else dict(hit_rate=q_table.telemetry.hit_rate)
+    return dict(game=game, countries=len(reserves), turns=turns, seconds=seconds,
+                turns_per_second=turns / seconds if seconds else 0, total_reserve=sum(reserves),
+                mean_reserve=sum(reserves) / len(reserves), lowest_reserve=ordered[0],
+                median_reserve=ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2,
+                highest_reserve=ordered[-1], mean_income=sum(incomes) / len(incomes), highest_income=max(incomes),
+                q_table_states=len(q_table), epsilon=q_table.epsilon, alpha=q_table.alpha, **telemetry)
+
+
+class Reporter:
+    # Output of a training run. Only every `every`-th game is reported, to the terminal according to verbosity and,
+    # when a filename is given, to that file: its game_metrics as one JSON object per line, or as a CSV row when the
+    # filename ends in .csv. The file is appended to and flushed after every line, so a running training can be
+    # followed. Countries are only formatted at the DETAILED level (JSON lines only)
+    CSV_FIELDS = ('game', 'countries', 'turns', 'seconds', 'turns_per_second', 'total_reserve', 'mean_reserve',
+                  'lowest_reserve', 'median_reserve', 'highest_reserve', 'mean_income', 'highest_income',
+                  'q_table_states', 'epsilon', 'alpha', 'hit_rate')
+
+    def __init__(self, verbosity=VERBOSITY, every=1, filename=None):
+        self.verbosity = verbosity
+        self.every = max(1, every)
+        self.file = open(filename, 'a', buffering=1, newline='') if filename else None
+        self.csv = None
+        if filename and filename.endswith('.csv'):
+            self.csv = csv.DictWriter(self.file, self.CSV_FIELDS, extrasaction='ignore')
+            if self.file.tell() == 0:
+                self.csv.writeheader()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def game_finished(self, record, country_list=None):
+        # country_list is None when the game was played in a worker process
+        if record['game'] % self.every or (self.verbosity < SUMMARY and self.file is None):
+            return
+
+        if self.verbosity >= DETAILED and country_list is not None:
+            record = dict(record, country_list=describe_countries(country_list))
+            print(country_list)
+        elif self.verbosity >= SUMMARY:
+            print(f"Game {record['game']}: highest reserve {record['highest_reserve']}, "
+                  f"highest income {record['highest_income']}")
+
+        if self.csv is not None:
+            self.csv.writerow(record)
+        elif self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+
+    def progress(self, percent):
+        if self.verbosity >= PROGRESS:
+            print(f"Training {percent}% complete")
+
+
+@dataclass
+class SimulationConfig:
+    countries: int = COUNTRY_COUNT
+    turns: int = TURNS
+    games: int = GAMES
+    engine: str = ENGINE
+    workers: int = WORKERS
+    batch: int = 1  # games played at once in a BatchEnv, with ArrayWorld rules (single-process runs only, without
+    # replay_file or profiling) and play_batch's Q updates
+    seed: int | None = SEED
+    epsilon: float = EPSILON
+    alpha: float = ALPHA
+    gamma: float = GAMMA
+    decay_rate: float = DECAY_RATE
+    q_table_file: str = Q_TABLE_FILE
+    save: bool = True  # False trains on the loaded table without ever writing it back
+    checkpoint_games: int | None = CHECKPOINT_GAMES
+    checkpoint_seconds: float | None = CHECKPOINT_SECONDS
+    verbosity: int = VERBOSITY
+    report_every: int = 1  # report every n-th game
+    report_file: str | None = None  # JSON lines (or .csv) file the reported games are appended to
+    profile: bool = False  # time the turn phases with a TurnProfiler (single-process runs of batch 1 only)
+    profile_file: str | None = None  # also cProfile the run into this file, plus a .folded flame graph file
+    replay_file: str | None = None  # record every game to this ReplayLog file (single-process runs of batch 1 only)
+    stop_when: Callable[[dict], bool] | None = None  # called with the game_metrics of every game, True stops training
+    evaluate: bool = False  # play the loaded table as a GreedyPolicy, without learning (object engine, single process)
+    experience: int = 0  # capacity of an ExperienceBuffer the AI countries act into, replayed after every game (0: learn
+    # every step as it is played; single-process runs only)
+    experience_batch: int = EXPERIENCE_BATCH
+    telemetry: bool = False  # count state visits with a StateTelemetry, reported in Results.telemetry (single process)
+    max_states: int | None = None  # bounded mode: save the table pruned to this many states at every checkpoint...
+    min_visits: int = 0  # ...and forget the states visited fewer times than this (both turn telemetry on)
+
+
+@dataclass
+class Results:
+    config: SimulationConfig
+    q_table: QTable | None = None
+    reserves: list = field(default_factory=list)  # final reserve of every country, one list per game
+    incomes: list = field(default_factory=list)  # final income per turn of every country, one list per game
+    phase_times: dict = field(default_factory=dict)  # seconds spent in each phase of the run
+    elapsed: float = 0
+    interrupted: bool = False
+    stopped: bool = False  # config.stop_when ended the run early
+    profile: dict | None = None  # TurnProfiler.report() of a profiled run
+    seeds: list = field(default_factory=list)  # seed of every game of a seeded run, to play a game again with new_world
+    telemetry: dict | None = None  # StateTelemetry.report() with the load and save times, of a run with telemetry
+
+    def add_time(self, phase, seconds):
+        self.phase_times[phase] = self.phase_times.get(phase, 0) + seconds
+
+    @property
+    def games_played(self):
+        return len(self.reserves)
+
+    @property
+    def turns_per_second(self):
+        return self.games_played * self.config.turns / self.elapsed if self.elapsed else 0
+
+    @property
+    def total_reserve(self):
+        total = 0
+        for reserves in self.reserves:
+            for reserve in reserves:
+                total += reserve
+        return total
+
+    @property
+    def average_reserve(self):
+        return self.total_reserve / max(1, sum(len(reserves) for reserves in self.reserves))
+
+    @property
+    def highest_reserve(self):
+        return max((reserve for reserves in self.reserves for reserve in reserves), default=0)
+
+    @property
+    def highest_income(self):
+        return max((income for incomes in self.incomes for income in incomes), default=0)
+
+
+def new_world(count=COUNTRY_COUNT, q_table=None, engine=ENGINE, reuse=None, seed=None):
+    # reuse takes the world of a finished game and resets it instead of allocating a new one.
+    # Worlds with the same seed draw the same random numbers, whichever engine plays them
+    rngs = random_streams(seed, count)
+    if engine == 'array':
+        if isinstance(reuse, ArrayWorld) and reuse.count == count:
+            reuse.reset(q_table, rngs)
+            return reuse
+        return ArrayWorld(count, q_table, rngs)
+
+    if isinstance(reuse, World) and len(reuse) == count:
+        reuse.reset()
+        for country, rng in zip(reuse, rngs):
+            country.reset(q_table, rng)
+        return reuse
+
+    country_list = World(count)
+    for i in range(count):
+        country_list[i] = Countries(i, country_list, q_table, rngs[i])
+    return country_list
+
+
+def fork_world(snapshot, q_table=None, seed=None):
+    # A new world in the state of snapshot, with its own random streams from seed (the global random module
+    # without one), so it can play a different future than the world the snapshot was taken from
+    country_list = new_world(snapshot.count, q_table, snapshot.engine, seed=seed)
+    country_list.restore(snapshot, rngs=False)
+    return country_list
+
+
+class RuleBased:
+    # q_table of the countries that play Countries.rule_based instead of a learned policy, e.g. in a tournament
+    pass
 
-        # Setup
-        load_q_table()
-        for i in range(COUNTRY_COUNT):
-            country_list.append(Countries(i))
 
-        # Game loop
-        for current_turn in range(TURNS):
+class Lookahead:
+    # Monte-Carlo lookahead for Countries.play_lookahead: every action is scored by playing it in rollouts, forks
+    # of the world where everyone (this country included, for the rest of the rollout) plays policy, a GreedyPolicy,
+    # for the rest of the turn and horizon more turns. The score is the reserve the country would end the game with
+    # if its income stayed as it is at the end of the rollout, averaged over the rollouts
+    def __init__(self, policy, turns=TURNS, rollouts=LOOKAHEAD_ROLLOUTS, horizon=LOOKAHEAD_TURNS, seed=None):
+        self.policy = policy
+        self.turns = turns  # of the game, no rollout goes past its end
+        self.rollouts = rollouts
+        self.horizon = horizon
+        self.rng = random.Random(seed)  # the random stream of every country in the rollouts
+        self.scratch = None  # the world rollouts are played in, restored from the snapshot before each
+
+    def action(self, country, turn):
+        # The best action of country, by rollouts from its world as it is now. DO_NOTHING unless another one
+        # scores better
+        snapshot = country.world.snapshot(rngs=False)
+        if self.scratch is None or len(self.scratch) != snapshot.count:
+            self.scratch = new_world(snapshot.count, self.policy, 'object')
+            for scratch_country in self.scratch:
+                scratch_country.rng = self.rng
+
+        best_action, best_score = DO_NOTHING, self.score(snapshot, country.name, turn, DO_NOTHING)
+        for action_index in range(len(ACTIONS)):
+            if action_index != DO_NOTHING:
+                score = self.score(snapshot, country.name, turn, action_index)
+                if score > best_score:
+                    best_action, best_score = action_index, score
+        return best_action
+
+    def score(self, snapshot, name, turn, action_index):
+        total = 0
+        last_turn = min(turn + self.horizon, self.turns - 1)
+        for _ in range(self.rollouts):
+            self.scratch.restore(snapshot, rngs=False)
+            country = self.scratch[name]
+            if action_index == PURCHASE_MINE:
+                country.purchase_mine(turn)
+            elif action_index != DO_NOTHING:
+                getattr(country, ACTIONS[action_index])()
+            if action_index != DO_NOTHING:  # which ends the turn
+                country.play_greedy(turn)
+
+            for rollout_turn in range(turn, last_turn + 1):
+                for nation in self.scratch:
+                    if rollout_turn == turn and nation.name <= name:
+                        continue  # they have played this turn already
+                    nation.generate_money()
+                    nation.find_perception()
+                    nation.play_greedy(rollout_turn)
+            total += country.reserve + country.generate_money(False) * (self.turns - last_turn)
+        return total / self.rollouts
+
+
+def play_game(country_list, turns=TURNS, log=None, first_turn=0, evaluate=False):
+    # log is a ReplayLog the game is recorded to. first_turn > 0 plays only the end of a game, from a prepared world
+    # (or a restored snapshot). evaluate plays the AI countries with play_greedy, their q_table being a GreedyPolicy.
+    # Countries whose q_table is a Lookahead play with play_lookahead either way, and those with a RuleBased one with
+    # rule_based
+    if log is not None:
+        if isinstance(country_list, ArrayWorld):
+            log.start_game(country_list.count)
+            country_list.log = log
+        else:
+            log.start_game(len(country_list))
             for nation in country_list:
-                nation.generate_money()
-                if nation.player:
-                    nation.competitor_info()
-                    nation.play_turn(current_turn, TURNS)
+                nation.log = log
+
+    if evaluate and isinstance(country_list, ArrayWorld):
+        raise ValueError('Evaluation needs the object engine')
+
+    for current_turn in range(first_turn, turns):
+        if isinstance(country_list, ArrayWorld):
+            country_list.play_turn(current_turn)
+            continue
+
+        for nation in country_list:
+            nation.generate_money()
+            if nation.player:
+                nation.competitor_info()
+                nation.play_turn(current_turn, turns)
+            else:
+                nation.find_perception()
+                if isinstance(nation.q_table, Lookahead):
+                    nation.play_lookahead(current_turn)
+                elif isinstance(nation.q_table, RuleBased):
+                    nation.rule_based(current_turn)
+                    nation.find_power_level()
+                elif evaluate:
+                    nation.play_greedy(current_turn)
                 else:
-                    nation.find_perception()
                     nation.q_learning(current_turn)
+            if log is not None:
+                log.record(EVENT_END)
+
+
+def game_results(country_list):
+    # (reserves, incomes) of the countries at the end of a game
+    if isinstance(country_list, ArrayWorld):
+        return (country_list.reserve.tolist(),
+                [country_list.generate_money(i, False) for i in range(country_list.count)])
+    return [country.reserve for country in country_list], [country.generate_money(False) for country in country_list]
+
+
+# Every event is its kind byte followed by the fields of that kind, little-endian
+REPLAY_EVENTS = {
+    EVENT_GAME: struct.Struct('<BI'),  # country count, starts a game
+    EVENT_END: struct.Struct('<B'),  # the country whose turn it is ends it, the next one starts
+    EVENT_MINES: struct.Struct('<Bdd'),  # mines, cost
+    EVENT_TOWNS: struct.Struct('<Bdd'),  # towns, cost
+    EVENT_CONNECTION: struct.Struct('<BHd?'),  # importer, cost, connected
+    EVENT_DISCONNECT: struct.Struct('<BH'),  # importer
+    EVENT_BLOCK: struct.Struct('<BHd'),  # exporter, cost
+    EVENT_UNBLOCK: struct.Struct('<BH'),  # exporter
+}
+# Method of Countries and ArrayWorld that applies each event
+REPLAY_METHODS = {EVENT_MINES: 'add_mines', EVENT_TOWNS: 'add_towns', EVENT_CONNECTION: 'connect',
+                  EVENT_DISCONNECT: 'disconnect', EVENT_BLOCK: 'block', EVENT_UNBLOCK: 'unblock'}
+
+
+class ReplayLog:
+    # Streams every change played games make to a replay file: the magic, then per game an EVENT_GAME and the
+    # changes of each country's turn followed by its EVENT_END. Actions that change nothing aren't recorded
+    def __init__(self, filename):
+        self.file = open(filename, 'wb', buffering=1 << 16)
+        self.file.write(REPLAY_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start_game(self, count):
+        self.record(EVENT_GAME, count)
+
+    def record(self, kind, *fields):
+        self.file.write(REPLAY_EVENTS[kind].pack(kind, *fields))
+
+    def close(self):
+        self.file.close()
+
+
+def read_replay(filename):
+    # Yields (country count, events) for every game of a replay file, events being (kind, *fields) tuples
+    with open(filename, 'rb') as file:
+        data = file.read()
+    if data[:len(REPLAY_MAGIC)] != REPLAY_MAGIC:
+        raise ValueError(f'{filename} is not a replay file')
+
+    count, events = None, []
+    position = len(REPLAY_MAGIC)
+    while position < len(data):
+        event = REPLAY_EVENTS[data[position]]
+        if position + event.size > len(data):
+            break  # the last event of a file whose game was cut short
+        kind, *fields = event.unpack_from(data, position)
+        position += event.size
+        if kind == EVENT_GAME:
+            if count is not None:
+                yield count, events
+            count, events = fields[0], []
+        else:
+            events.append((kind, *fields))
+    if count is not None:
+        yield count, events
+
+
+def replay_game(country_list, events):
+    # Applies the events of one game to a new world of either engine, without choosing any action: each country
+    # only earns its income at the start of its turn and updates its power level at the end
+    if isinstance(country_list, ArrayWorld):
+        def apply(i, method, *fields):
+            getattr(country_list, method)(i, *fields)
+        count = country_list.count
+    else:
+        def apply(i, method, *fields):
+            getattr(country_list[i], method)(*fields)
+        count = len(country_list)
+
+    i, started = 0, False
+    for kind, *fields in events:
+        if not started:
+            apply(i, 'generate_money')
+            started = True
+        if kind == EVENT_END:
+            apply(i, 'find_power_level')
+            i, started = (i + 1) % count, False
+        else:
+            apply(i, REPLAY_METHODS[kind], *fields)
+    return country_list
+
+
+def replay(filename, engine=ENGINE):
+    # Yields the world at the end of every game of a replay file
+    for count, events in read_replay(filename):
+        yield replay_game(new_world(count, engine=engine), events)
+
+
+class BatchEnv:
+    # Plays size independent games of ArrayWorld rules in lockstep, behind a gym-like reset()/step(actions) API.
+    # The worlds are views into arrays shaped (size, countries) and (size, countries, countries), so observations,
+    # affordability checks and turn-end states of all worlds take one array operation each.
+    # A step plays one action (or a run of it, see repeat_counts) of the acting country of every world. DO_NOTHING, or no longer affording anything,
+    # ends that country's turn and pays its q_learning reward; the next country that can afford something acts next.
+    # Countries that can't afford anything play their turn without a step
+    NO_OP_REPEATS = 2 ** 62  # repeat_counts of an action that changes nothing, as often as it's repeated
+
+    def __init__(self, size, countries=COUNTRY_COUNT, turns=TURNS):
+        if np is None:
+            raise ImportError('BatchEnv requires numpy')
+
+        self.size = size
+        self.countries = countries
+        self.turns = turns
+        self.arrays = {}
+        for name, dtype in ArrayWorld.COUNTRY_ARRAYS:
+            self.arrays[name] = np.zeros((size, countries), dtype=dtype)
+        for name, dtype in ArrayWorld.PAIR_ARRAYS:
+            self.arrays[name] = np.zeros((size, countries, countries), dtype=dtype)
+        self.worlds = [ArrayWorld(countries, arrays={name: values[k] for name, values in self.arrays.items()})
+                       for k in range(size)]
+
+        self.turn = np.zeros(size, dtype=np.int64)
+        self.country = np.zeros(size, dtype=np.int64)  # acting country of each world
+        self.done = np.ones(size, dtype=bool)
+        self.turn_started = np.zeros(size, dtype=bool)  # the current step is the first of the acting country's turn
+        self.pre_income = [0] * size
+        self.pre_connections = [0] * size
+
+    def reset(self, seeds=None):
+        # Starts a new game in every world, with the random streams of seeds[k] (the global random module if None)
+        # and returns the first observations
+        for k, world in enumerate(self.worlds):
+            world.reset(None, random_streams(seeds[k] if seeds else None, self.countries))
+        self.turn.fill(0)
+        self.country.fill(0)
+        self.done.fill(False)
+        self.turn_started.fill(False)
+        for k in range(self.size):
+            self.begin_turn(k)
+        return self.observations()
+
+    def observations(self, worlds=None):
+        # get_state of the acting country of every world (or of the given worlds), shape (size, 4)
+        if worlds is None:
+            worlds = np.arange(self.size)
+        countries = self.country[worlds]
+        return discretize_states(self.arrays['power_level'][worlds, countries], self.arrays['reserve'][worlds, countries],
+                                 self.arrays['connection_count'][worlds, countries], self.turn[worlds])
+
+    def step(self, actions, times=None):
+        # Returns (observations, rewards, dones, info). rewards are only paid to worlds whose acting country ended
+        # its turn, info['turn_ended'] marks them and info['final_states'] holds those countries' get_state at the end
+        # of their turn. Actions of finished worlds are ignored. times[k] plays the action of world k that many times
+        # in a row, at most its repeat_counts (1 for every world by default)
+        active = np.flatnonzero(~self.done)
+        actions = np.asarray(actions)
+        times = np.ones(self.size, dtype=np.int64) if times is None else np.asarray(times)
+        self.turn_started.fill(False)
+
+        # Each action is played in all the worlds that chose it at once
+        acting = actions[active]
+        for action, method in enumerate(ACTIONS):
+            if action != DO_NOTHING:
+                worlds = active[acting == action]
+                if len(worlds):
+                    getattr(self, method)(worlds, times[worlds])
+
+        countries = self.country[active]
+
+        # (reserve >= 3 already covers the mine and power level 1-3 costs of can_afford_anything)
+        reserves = self.arrays['reserve'][active, countries]
+        can_afford = (reserves >= self.arrays['power_level'][active, countries]) | (reserves >= 3)
+        ended = active[(actions[active] == DO_NOTHING) | ~can_afford]
+
+        rewards = np.zeros(self.size)
+        final_states = np.zeros((self.size, 4), dtype=np.int64)
+        if len(ended):
+            for k, i in zip(ended.tolist(), self.country[ended].tolist()):
+                world = self.worlds[k]
+                world.defensive_block(i)
+                world.find_power_level(i)
+                connection_gain = world.connection_count[i].item() - self.pre_connections[k]
+                rewards[k] = (10 * (world.generate_money(i, False) - self.pre_income[k]) + 7 * connection_gain
+                              + 12 * world.mines[i].item())
+            final_states[ended] = self.observations(ended)
+
+            for k in ended.tolist():
+                if self.next_country(k):
+                    self.begin_turn(k)
+
+        turn_ended = np.zeros(self.size, dtype=bool)
+        turn_ended[ended] = True
+        return self.observations(), rewards, self.done.copy(), {'turn_ended': turn_ended, 'final_states': final_states}
+
+    def repeat_counts(self, worlds, actions):
+        # How many times in a row the acting country of each given world can play actions[k] in a step, the passes
+        # that repeat_greedy makes at once: a run of towns or of connection bonuses up to repeat_count, and any
+        # number (NO_OP_REPEATS) of an action that changes nothing, each repeat drawing what the first draws.
+        # 1 for every other action
+        counts = np.ones(len(worlds), dtype=np.int64)
+        countries = self.country[worlds]
+        reserves = self.arrays['reserve'][worlds, countries]
+        power_levels = self.arrays['power_level'][worlds, countries]
+
+        towns = actions == PURCHASE_TOWN
+        counts[towns & (reserves < power_levels)] = self.NO_OP_REPEATS
+        bulk = np.flatnonzero(towns & (power_levels <= reserves) & (reserves < EXACT_FLOATS))
+        counts[bulk] = self.purchase_counts(worlds[bulk], power_levels[bulk])
+
+        mines = np.flatnonzero(actions == PURCHASE_MINE)
+        mines_purchased, bulk_mines = self.mine_purchases(worlds[mines])
+        counts[mines[np.where(bulk_mines, mines_purchased == 0, reserves[mines] < 3)]] = self.NO_OP_REPEATS
+
+        counts[actions == REMOVE_CONNECTION] = self.NO_OP_REPEATS
+        blockades = np.flatnonzero(actions == ACTIONS.index('purchase_blockade'))
+        counts[blockades[~self.can_blockade(worlds[blockades])]] = self.NO_OP_REPEATS
+        unblocks = np.flatnonzero(actions == ACTIONS.index('remove_blockade'))
+        counts[unblocks[~self.can_unblock(worlds[unblocks])]] = self.NO_OP_REPEATS
+
+        connections = np.flatnonzero(actions == PURCHASE_CONNECTION)
+        if not len(connections):
+            return counts
+        worlds, countries, reserves = worlds[connections], countries[connections], reserves[connections]
+        connection_levels, ties = self.connection_ties(worlds)
+        connection_counts = self.arrays['connection_count'][worlds, countries]
+        costs = np.where(connection_counts[:, None] == 0, 3, 6 * connection_levels)
+        # No best target, or none of them affordable: nothing is bought, each repeat draws from the same tie
+        unaffordable = ~(ties & (reserves[:, None] >= costs)).any(axis=1)
+        counts[connections[unaffordable]] = self.NO_OP_REPEATS
+
+        # As bulk_bonus: the only best target, not connected yet, while the country is maxed out on connections
+        importers = ties.argmax(axis=1)
+        rows = np.arange(len(worlds))
+        bonus_costs = costs[rows, importers]
+        importer_reserves = self.arrays['reserve'][worlds, importers]
+        bonus = ((ties.sum(axis=1) == 1) & (connection_levels[rows, importers] == 1)
+                 & (connection_counts + 1 > np.take(MAX_CONNECTIONS, power_levels[connections] - 1))
+                 & (bonus_costs <= reserves) & (reserves < EXACT_FLOATS) & (np.abs(importer_reserves) < EXACT_FLOATS)
+                 & (self.arrays['life_time_earning'][worlds, importers] < EXACT_FLOATS))
+        bonus = np.flatnonzero(bonus)
+        counts[connections[bonus]] = self.purchase_counts(worlds[bonus], bonus_costs[bonus])
+        return counts
+
+    def purchase_counts(self, worlds, costs):
+        # repeat_count of the acting country of each given world, for purchases at costs: of the state only the money
+        # level changes with them
+        countries = self.country[worlds]
+        reserves = self.arrays['reserve'][worlds, countries]
+        money_levels = np.searchsorted(MONEY_THRESHOLDS, reserves, side='right')
+        low = np.ones(len(worlds), dtype=np.int64)
+        high = (reserves // costs).astype(np.int64)
+        while (searching := low < high).any():
+            middle = (low + high + 1) // 2
+            same = np.searchsorted(MONEY_THRESHOLDS, reserves - (middle - 1) * costs, side='right') == money_levels
+            low = np.where(searching & same, middle, low)
+            high = np.where(searching & ~same, middle - 1, high)
+        return low
+
+    # The ArrayWorld actions of the acting countries of the given worlds, as array operations over those worlds,
+    # each played times times in a row. The random draws are made in the same order from the same streams, so every
+    # world plays exactly as an ArrayWorld would. Changes too rare to be worth vectorising go through the world's
+    # own methods
+
+    def mine_purchases(self, worlds):
+        # purchase_mine's mines_purchased, and whether it buys that many (more than one mine already) rather than
+        # the first one
+        countries = self.country[worlds]
+        turns = self.turn[worlds]
+        income_percentages = MINE_BUDGET_ARRAY[np.minimum(turns, len(MINE_BUDGETS) - 1)]
+        late = turns >= len(MINE_BUDGETS)
+        if late.any():  # past the table, as in mine_budget
+            income_percentages[late] = np.minimum(0.01 * (100 - turns[late]) * 3, 1)
+        mine_cost = 7
+        mines_purchased = self.arrays['reserve'][worlds, countries] * income_percentages // mine_cost
+        return mines_purchased, self.arrays['mines'][worlds, countries] > 1
 
-        epsilon = max(0.001, epsilon * DECAY_RATE)
-        alpha = max(0.01, alpha * DECAY_RATE)
+    def purchase_mine(self, worlds, times):
+        # (repeats are no-ops, see repeat_counts)
+        mine_cost = 7
+        first_mine_cost = 3
 
-        print(country_list)
-        print(f"Training {math.ceil(game / GAMES * 100)}% complete")
-        save_q_table()
+        countries = self.country[worlds]
+        reserves = self.arrays['reserve'][worlds, countries]
+        mines = self.arrays['mines'][worlds, countries]
+        mines_purchased, bulk = self.mine_purchases(worlds)
+
+        first = ~bulk & (reserves >= first_mine_cost)
+        self.arrays['reserve'][worlds, countries] = np.where(
+            bulk, reserves - mines_purchased * mine_cost, np.where(first, reserves - first_mine_cost, reserves))
+        self.arrays['mines'][worlds, countries] = np.where(bulk, mines + mines_purchased, np.where(first, mines + 1, mines))
+
+    def purchase_town(self, worlds, times):
+        countries = self.country[worlds]
+        town_costs = self.arrays['power_level'][worlds, countries]
+        bought = self.arrays['reserve'][worlds, countries] >= town_costs
+        worlds, countries = worlds[bought], countries[bought]
+        self.arrays['reserve'][worlds, countries] -= town_costs[bought] * times[bought]
+        self.arrays['towns'][worlds, countries] += times[bought]
+
+    def connection_ties(self, worlds):
+        # The connection level purchase_connection would buy to every country (one row per world) and its tie of
+        # best targets, empty when nothing is bought
+        countries = self.country[worlds]
+        rows = np.arange(len(worlds))
+        connection_levels = self.arrays['levels'][worlds, countries] + 1
+        sizes = self.arrays['towns'][worlds] + self.arrays['markets'][worlds]
+        values = (4 * (sizes // CONNECTION_DIVISOR_ARRAY[connection_levels])) - connection_levels * 6
+        values += PERCEPTION_VALUE * self.arrays['perception'][worlds, countries]
+        eligible = connection_levels <= MAX_CONNECTION_LEVEL
+        eligible[rows, countries] = False
+
+        best = np.where(eligible, values, np.iinfo(np.int64).min).max(axis=1)
+        # see ArrayWorld.purchase_connection: nothing is bought unless the best beats -1
+        return connection_levels, eligible & (values == best[:, None]) & (best[:, None] > -1)
+
+    def purchase_connection(self, worlds, times):
+        first_connection_cost = 3
 
-        for i in range(len(country_list)):
-            total_reserve += country_list[i].reserve
-            if country_list[i].reserve > highest_reserve:
-                highest_reserve = country_list[i].reserve
+        connection_levels, ties = self.connection_ties(worlds)
+        tie_counts = ties.sum(axis=1)
+        buying = np.flatnonzero(tie_counts)
+        if not len(buying):
+            return
+        worlds, countries, ties = worlds[buying], self.country[worlds[buying]], ties[buying]
+        picks = []
+        for k, i, count, repeats in zip(worlds.tolist(), countries.tolist(), tie_counts[buying].tolist(),
+                                        times[buying].tolist()):
+            rng = self.worlds[k].rngs[i]
+            for _ in range(repeats):
+                pick = rng.randint(0, count - 1)
+            picks.append(pick)
+        importers = (ties.cumsum(axis=1) > np.array(picks)[:, None]).argmax(axis=1)
+
+        connection_levels = connection_levels[buying, importers]
+        connection_counts = self.arrays['connection_count'][worlds, countries]
+        costs = np.where(connection_counts == 0, first_connection_cost, 6 * connection_levels)
+        connected = ((connection_levels > 1)
+                     | (connection_counts + 1 <= np.take(MAX_CONNECTIONS, self.arrays['power_level'][worlds, countries] - 1)))
+        affordable = np.flatnonzero(self.arrays['reserve'][worlds, countries] >= costs)
+        for k, i, importer, cost, connection, repeats in zip(
+                worlds[affordable].tolist(), countries[affordable].tolist(), importers[affordable].tolist(),
+                costs[affordable].tolist(), connected[affordable].tolist(), times[buying][affordable].tolist()):
+            self.worlds[k].connect(i, importer, cost, connection, repeats)
+
+    def remove_connection(self, worlds, times):
+        # Only the tie-break draws, ArrayWorld.remove_connection never removes anything
+        countries = self.country[worlds]
+        levels = self.arrays['levels'][worlds, countries]
+        connected = levels > 0
+        has_connections = connected.any(axis=1)
+        worlds, countries, levels, connected, times = (worlds[has_connections], countries[has_connections],
+                                                       levels[has_connections], connected[has_connections],
+                                                       times[has_connections])
+        if not len(worlds):
+            return
 
-        for i in range(len(country_list)):
-            country_income = country_list[i].generate_money(False)
-            if country_income > highest_income:
-                highest_income = country_income
+        # Each world's importers in connection order, the countries it doesn't connect to after them
+        order = np.argsort(np.where(connected, self.arrays['opened'][worlds, countries], np.iinfo(np.int64).max),
+                           axis=1, kind='stable')
+        levels = np.take_along_axis(levels, order, axis=1)
+        connected = np.take_along_axis(connected, order, axis=1)
+        mines = np.take_along_axis(self.arrays['mines'][worlds], order, axis=1)
+        perception = np.take_along_axis(self.arrays['perception'][worlds, countries], order, axis=1)
+        sizes = (self.arrays['towns'][worlds, countries] + self.arrays['markets'][worlds, countries])[:, None]
+
+        estimated_income = np.floor(mines / 2) + sizes // CONNECTION_DIVISOR_ARRAY[levels] + levels * 3
+        estimated_income -= PERCEPTION_VALUE * perception
+        estimated_income[~connected] = -np.inf
+        fallback_cut_counts = np.count_nonzero(
+            connected & (estimated_income >= np.maximum.accumulate(estimated_income, axis=1)), axis=1)
+        for k, i, count, repeats in zip(worlds.tolist(), countries.tolist(), fallback_cut_counts.tolist(), times.tolist()):
+            rng = self.worlds[k].rngs[i]
+            for _ in range(repeats):
+                rng.randint(0, count - 1)
+
+    def can_blockade(self, worlds):
+        # Only worlds with money and an unblocked incoming connection can blockade
+        blockade_cost = 3
 
-except KeyboardInterrupt:
-    pass
+        countries = self.country[worlds]
+        incoming = self.arrays['levels'][worlds, :, countries] > 0
+        return ((self.arrays['reserve'][worlds, countries] >= blockade_cost)
+                & (incoming & ~self.arrays['blocked'][worlds, :, countries]).any(axis=1))
+
+    def purchase_blockade(self, worlds, times):
+        # (repeats are no-ops, see repeat_counts)
+        possible = self.can_blockade(worlds)
+        for k, i in zip(worlds[possible].tolist(), self.country[worlds[possible]].tolist()):
+            self.worlds[k].purchase_blockade(i)
+
+    def can_unblock(self, worlds):
+        # Only blockades of exporters the country also connects to can be removed
+        countries = self.country[worlds]
+        return (self.arrays['blocked'][worlds, :, countries] & (self.arrays['levels'][worlds, countries] > 0)).any(axis=1)
+
+    def remove_blockade(self, worlds, times):
+        # (repeats are no-ops, see repeat_counts)
+        possible = self.can_unblock(worlds)
+        for k, i in zip(worlds[possible].tolist(), self.country[worlds[possible]].tolist()):
+            self.worlds[k].remove_blockade(i)
+
+    def begin_turn(self, k):
+        # Plays the turns of world k until a country can afford something, which becomes the acting country
+        world = self.worlds[k]
+        while True:
+            i = self.country[k].item()
+            world.generate_money(i)
+            world.find_perception(i)
+            if world.can_afford_anything(i):
+                self.pre_income[k] = world.generate_money(i, False)
+                self.pre_connections[k] = world.connection_count[i].item()
+                self.turn_started[k] = True
+                return
+
+            world.defensive_block(i)
+            world.find_power_level(i)
+            if not self.next_country(k):
+                return
+
+    def next_country(self, k):
+        # Moves world k on to the next country, False once its game is over
+        self.country[k] += 1
+        if self.country[k] == self.countries:
+            self.country[k] = 0
+            self.turn[k] += 1
+            if self.turn[k] == self.turns:
+                self.done[k] = True
+                return False
+        return True
+
+
+def play_batch(env, q_table, seeds=None):
+    # Plays one game in every world of env, learning into q_table, and returns each world's (reserves, incomes).
+    # Every turn of a country is one Q update, from its state and action at the first step of the turn to its reward
+    # and state at the end of the turn. The epsilon-greedy draws come from one numpy Generator seeded with seeds.
+    # This is not q_learning in lockstep: q_learning credits the action it draws before execute_actions (which then
+    # draws its own), and draws from each country's random stream, so a seeded batch run learns a different table
+    # than the same run with batch=1.
+    # As in repeat_greedy, a greedy action is chosen again by every following pass that doesn't explore for as long
+    # as the state stays the same: the passes up to the first one that explores (one geometric draw) are played in
+    # one step, at most env.repeat_counts, and that pass's random action is played in the next step
+    policy_rng = np.random.default_rng(seeds)
+    states = env.reset(seeds)
+    first_states = np.zeros_like(states)
+    first_actions = np.zeros(env.size, dtype=np.int64)
+    actions = np.zeros(env.size, dtype=np.int64)
+    times = np.ones(env.size, dtype=np.int64)
+    explored = np.full(env.size, -1)  # random action of the pass that ended a run (its country can still act), or -1
+
+    while not env.done.all():
+        active = np.flatnonzero(~env.done)
+        actions[active] = q_table.select_actions(states[active], policy_rng)
+        pending = active[explored[active] >= 0]
+        actions[pending] = explored[pending]
+        explored[pending] = -1
+        started = env.turn_started.copy()
+        first_states[started] = states[started]
+        first_actions[started] = actions[started]
+
+        indices = q_table.indices(states[active])
+        greedy = np.frombuffer(q_table.greedy, dtype=np.uint8)[indices]
+        repeated = (actions[active] == greedy) & (actions[active] != DO_NOTHING)
+        runs = active[repeated]
+        times.fill(1)
+        if len(runs):
+            most = env.repeat_counts(runs, actions[runs])
+            passes = np.minimum(policy_rng.geometric(q_table.epsilon, len(runs)), most)
+            times[runs] = passes
+            explorers = runs[passes < most]
+            explored[explorers] = policy_rng.integers(0, q_table.num_of_actions, len(explorers))
+            if q_table.telemetry is not None:  # select_actions counted the first pass of each run
+                longer = passes > 1
+                q_table.telemetry.visit_many(indices[repeated][longer], np.ones(np.count_nonzero(longer)),
+                                             passes[longer] - 1)
+
+        states, rewards, _, info = env.step(actions, times)
+        for k in np.flatnonzero(info['turn_ended']).tolist():
+            q_table.update(tuple(first_states[k].tolist()), first_actions[k].item(), rewards[k].item(),
+                           tuple(info['final_states'][k].tolist()))
+
+    return [game_results(world) for world in env.worlds]
+
+
+worker_world = None  # world a train_worker process reuses from one task to the next
+
+
+def train_worker(task):
+    global worker_world
+    q_table, epsilon, alpha, seed, countries, turns, engine = task
+    q_table.epsilon, q_table.alpha = epsilon, alpha
+    q_table.visits = array('q', bytes(8 * len(q_table.values)))
+
+    worker_world = new_world(countries, q_table, engine, reuse=worker_world, seed=seed)
+    play_game(worker_world, turns)
+    return q_table, game_results(worker_world)
+
+
+def train_parallel(session, config, results, reporter):
+    # Trains config.workers games at a time against a snapshot of session.q_table, merging their updates into it
+    # between rounds. Every game's (reserves, incomes) is added to results and its game_metrics yielded, in game order
+    master = random.Random(config.seed)  # game seeds in the same order as a serial run with that seed
+
+    with multiprocessing.Pool(config.workers) as pool:
+        for first_game in range(0, config.games, config.workers):
+            q_table = session.q_table
+            tasks = []
+            for _ in range(first_game, min(first_game + config.workers, config.games)):
+                seed = master.getrandbits(64)
+                if config.seed is not None:
+                    results.seeds.append(seed)
+                tasks.append((q_table, q_table.epsilon, q_table.alpha, seed, config.countries, config.turns, config.engine))
+                q_table.decay(config.decay_rate)
+
+            # map keeps task order, so the merge doesn't depend on which worker finishes first
+            start = time.perf_counter()
+            round_results = pool.map(train_worker, tasks)
+            seconds = time.perf_counter() - start
+            results.add_time('play', seconds)
+
+            start = time.perf_counter()
+            session.q_table = merge_q_tables(q_table, [table for table, _ in round_results])
+            results.add_time('merge', time.perf_counter() - start)
+            start = time.perf_counter()
+            session.game_finished(len(tasks))
+            results.add_time('checkpoint', time.perf_counter() - start)
+
+            reporter.progress(math.ceil((first_game + len(tasks)) / config.games * 100))
+            for game, (_, (reserves, incomes)) in enumerate(round_results, first_game):
+                results.reserves.append(reserves)
+                results.incomes.append(incomes)
+                record = game_metrics(game, reserves, incomes, session.q_table, seconds / len(tasks), config.turns)
+                reporter.game_finished(record)
+                yield record
+
+
+def train_batched(session, config, results, reporter):
+    # Trains config.batch games at a time in one BatchEnv, in the same game order and with the same game seeds as a
+    # serial run, but with play_batch's learning (see there). Every game's (reserves, incomes) is added to results and
+    # its game_metrics yielded
+    env = None
+    master = random.Random(config.seed) if config.seed is not None else None
+
+    for first_game in range(0, config.games, config.batch):
+        size = min(config.batch, config.games - first_game)
+        if env is None or env.size != size:
+            env = BatchEnv(size, config.countries, config.turns)
+        seeds = None
+        if master is not None:
+            seeds = [master.getrandbits(64) for _ in range(size)]
+            results.seeds.extend(seeds)
+
+        start = time.perf_counter()
+        batch_results = play_batch(env, session.q_table, seeds)
+        seconds = time.perf_counter() - start
+        results.add_time('play', seconds)
+        if session.q_table.experience is not None:
+            start = time.perf_counter()
+            session.q_table.replay(config.experience_batch)
+            results.add_time('replay', time.perf_counter() - start)
+        if session.q_table.telemetry is not None:
+            session.q_table.telemetry.games += size
+        for _ in range(size):
+            session.q_table.decay(config.decay_rate)
+
+        start = time.perf_counter()
+        session.game_finished(size)
+        results.add_time('checkpoint', time.perf_counter() - start)
+
+        reporter.progress(math.ceil((first_game + size) / config.games * 100))
+        for game, (reserves, incomes) in enumerate(batch_results, first_game):
+            results.reserves.append(reserves)
+            results.incomes.append(incomes)
+            record = game_metrics(game, reserves, incomes, session.q_table, seconds / size, config.turns)
+            reporter.game_finished(record, env.worlds[game - first_game])
+            yield record
+
+
+def train_serial(session, config, results, reporter, profiler=None, replay_log=None):
+    # Trains the games one after the other in this process. Every game's (reserves, incomes) is added to results and
+    # its game_metrics yielded
+    master = random.Random(config.seed) if config.seed is not None else None
+
+    country_list = None
+    for game in range(config.games):
+        start = time.perf_counter()
+        seed = None
+        if master is not None:
+            seed = master.getrandbits(64)
+            results.seeds.append(seed)
+        country_list = new_world(config.countries, session.q_table, config.engine, reuse=country_list, seed=seed)
+        play_game(country_list, config.turns, replay_log)
+        seconds = time.perf_counter() - start
+        results.add_time('play', seconds)
+        if session.q_table.experience is not None:
+            start = time.perf_counter()
+            session.q_table.replay(config.experience_batch)
+            results.add_time('replay', time.perf_counter() - start)
+        if session.q_table.telemetry is not None:
+            session.q_table.telemetry.games += 1
+        session.q_table.decay(config.decay_rate)
+        if profiler is not None:
+            profiler.game_finished()
+
+        start = time.perf_counter()
+        session.game_finished()
+        results.add_time('checkpoint', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        reserves, incomes = game_results(country_list)
+        results.reserves.append(reserves)
+        results.incomes.append(incomes)
+        results.add_time('results', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        record = game_metrics(game, reserves, incomes, session.q_table, seconds, config.turns)
+        reporter.game_finished(record, country_list)
+        reporter.progress(math.ceil((game + 1) / config.games * 100))
+        results.add_time('report', time.perf_counter() - start)
+        yield record
+
+
+def evaluate_serial(session, config, results, reporter, replay_log=None):
+    # Plays the games with session.q_table frozen into a GreedyPolicy, which is neither updated nor decayed. Every
+    # game's (reserves, incomes) is added to results and its game_metrics yielded
+    policy = GreedyPolicy(session.q_table)
+    master = random.Random(config.seed) if config.seed is not None else None
+
+    country_list = None
+    for game in range(config.games):
+        start = time.perf_counter()
+        seed = None
+        if master is not None:
+            seed = master.getrandbits(64)
+            results.seeds.append(seed)
+        country_list = new_world(config.countries, policy, 'object', reuse=country_list, seed=seed)
+        play_game(country_list, config.turns, replay_log, evaluate=True)
+        seconds = time.perf_counter() - start
+        results.add_time('play', seconds)
+
+        reserves, incomes = game_results(country_list)
+        results.reserves.append(reserves)
+        results.incomes.append(incomes)
+        record = game_metrics(game, reserves, incomes, session.q_table, seconds, config.turns)
+        reporter.game_finished(record, country_list)
+        reporter.progress(math.ceil((game + 1) / config.games * 100))
+        yield record
+
+
+def train(config=None, results=None):
+    # Trains config.games games (or only plays them, with config.evaluate), yielding the game_metrics of each as soon
+    # as it is finished, and fills results (a Results, to read once the generator is exhausted or closed). Breaking
+    # out of the loop, or config.stop_when, ends training early; the Q-table is still checkpointed
+    config = config or SimulationConfig()
+    if config.experience and config.workers > 1:
+        raise ValueError('Experience replay only works in single-process runs')
+    telemetry = config.telemetry or config.max_states is not None or config.min_visits > 0
+    if telemetry and config.workers > 1:
+        raise ValueError('State telemetry only works in single-process runs')
+    if config.batch > 1 and (config.replay_file or config.profile or config.profile_file):
+        raise ValueError('Batched runs can neither be recorded nor profiled, play them with batch=1')
+    if config.workers > 1 and (config.replay_file or config.profile or config.profile_file):
+        raise ValueError('Parallel runs can neither be recorded nor profiled, play them with workers=1')
+    results = results if results is not None else Results(config)
+    run_start = time.perf_counter()
+
+    start = time.perf_counter()
+    session = TrainingSession(config.q_table_file, config.checkpoint_games, config.checkpoint_seconds,
+                              read_only=not config.save or config.evaluate, max_states=config.max_states,
+                              min_visits=config.min_visits, required=config.evaluate)
+    session.q_table.epsilon, session.q_table.alpha, session.q_table.gamma = config.epsilon, config.alpha, config.gamma
+    if config.experience and not config.evaluate:
+        session.q_table.experience = ExperienceBuffer(config.experience, config.seed)
+    if telemetry and not config.evaluate:
+        session.q_table.telemetry = StateTelemetry(session.q_table.state_count)
+    results.add_time('load', time.perf_counter() - start)
+
+    profiler = TurnProfiler() if config.profile or config.profile_file else None
+    if profiler is not None:
+        profiler.enable()
+    code_profiler = cProfile.Profile() if config.profile_file else None
+    if code_profiler is not None:
+        code_profiler.enable()
+    replay_log = ReplayLog(config.replay_file) if config.replay_file else None
+
+    try:
+        with session, Reporter(config.verbosity, config.report_every, config.report_file) as reporter:
+            try:
+                if config.evaluate:
+                    games = evaluate_serial(session, config, results, reporter, replay_log)
+                elif config.workers > 1:
+                    games = train_parallel(session, config, results, reporter)
+                elif config.batch > 1:
+                    games = train_batched(session, config, results, reporter)
+                else:
+                    games = train_serial(session, config, results, reporter, profiler, replay_log)
+                try:
+                    for record in games:
+                        yield record
+                        if config.stop_when is not None and config.stop_when(record):
+                            results.stopped = True
+                            break
+                finally:
+                    games.close()  # right away, so a worker pool is shut down before the final checkpoint
+
+            except KeyboardInterrupt:
+                results.interrupted = True
+
+            start = time.perf_counter()  # leaving the block flushes the final checkpoint
+        results.add_time('checkpoint', time.perf_counter() - start)
+
+    finally:
+        if replay_log is not None:
+            replay_log.close()
+        if code_profiler is not None:
+            code_profiler.disable()
+            code_profiler.dump_stats(config.profile_file)
+        if profiler is not None:
+            profiler.disable()
+            results.profile = profiler.report()
+            if config.profile_file:
+                profiler.write_folded(config.profile_file + '.folded')
+
+        results.q_table = session.q_table
+        if session.q_table.telemetry is not None:
+            results.telemetry = dict(session.q_table.telemetry.report(session.q_table), load_seconds=session.load_seconds,
+                                     saves=session.saves, save_seconds=session.save_seconds,
+                                     saved_bytes=session.saved_bytes)
+        results.elapsed = time.perf_counter() - run_start
+
+
+def run_simulation(config=None):
+    # Trains config.games games and returns their Results; the world and the learning state live only in this call
+    config = config or SimulationConfig()
+    results = Results(config)
+    for _ in train(config, results):
+        pass
+    return results
+
+
+if __name__ == '__main__':
+    simulation = run_simulation()
 
-print(q_table)
-print(f'Average reserve (highest): {total_reserve / 1000} ({highest_reserve})')
-print(f'Highest income per turn: {highest_income}')
+    if VERBOSITY >= DETAILED:
+        print(simulation.q_table)
+    print(f'Average reserve (highest): {simulation.average_reserve} ({simulation.highest_reserve})')
+    print(f'Highest income per turn: {simulation.highest_income}')
+    if simulation.telemetry is not None:
+        print(f'Q-table telemetry: {simulation.telemetry}')
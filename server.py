@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import sys
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import main
+
+SERVER_HOST = '127.0.0.1'  # GameServer only listens locally
+SERVER_PORT = 8765
+MAX_GAMES = 64  # games a GameServer plays at once, later players wait for a free one
+SEAT_POLL_SECONDS = 0.5  # how often a game waiting for its player checks that the server is still running
+
+
+class SocketSeat:
+    # A player connected to a GameServer: every prompt and message is one line sent to it, every answer one line
+    # read from it. Its game runs in a worker thread that waits in ask() while the event loop carries the lines
+    def __init__(self, loop, reader, writer):
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    def ask(self, prompt):
+        self.tell(prompt)
+        try:
+            answer = asyncio.run_coroutine_threadsafe(self.reader.readline(), self.loop)
+        except RuntimeError:  # the event loop is closed
+            raise ConnectionError('The server stopped') from None
+        # Waited on in slices: once the server stops, its loop may never run the read, nor cancel it
+        while True:
+            try:
+                line = answer.result(SEAT_POLL_SECONDS)
+                break
+            except TimeoutError:
+                if self.closed or self.loop.is_closed():
+                    answer.cancel()
+                    raise ConnectionError('The server stopped') from None
+            except CancelledError:
+                raise ConnectionError('The server stopped') from None
+        if not line:
+            raise ConnectionError('The player left the game')
+        return line.decode(errors='replace').strip()
+
+    def tell(self, text):
+        if self.closed:
+            raise ConnectionError('The server stopped')
+        try:
+            self.loop.call_soon_threadsafe(self.write, (text + '\n').encode())
+        except RuntimeError:  # the event loop is closed
+            raise ConnectionError('The server stopped') from None
+
+    def write(self, data):
+        # On the event loop. Once the player has left, the rest of their game is played without sending anything
+        if not self.writer.is_closing() and not self.reader.at_eof():
+            self.writer.write(data)
+
+    def close(self):
+        # From any thread: the game's next (or current) ask or tell raises ConnectionError
+        self.closed = True
+        try:
+            self.loop.call_soon_threadsafe(self.reader.feed_eof)
+        except RuntimeError:
+            pass  # the loop is gone, ask notices closed instead
+
+
+class GameServer:
+    # Hosts one game per connection, the connected player in country seat and AI countries everywhere else. Games
+    # run in worker threads, so while a player thinks the AI countries of every other game keep playing, and the
+    # event loop keeps accepting players. The AI countries of all games learn on session.q_table, one step at a time
+    # (or play its GreedyPolicy without learning)
+    def __init__(self, session, countries=main.COUNTRY_COUNT, turns=main.TURNS, seat=0, max_games=MAX_GAMES, learn=True):
+        if not 0 <= seat < countries:
+            raise ValueError(f'Seat {seat} is not one of the {countries} countries')
+        self.session = session
+        self.countries = countries
+        self.turns = turns
+        self.seat = seat
+        self.policy = None if learn else main.GreedyPolicy(session.q_table)
+        self.lock = threading.Lock()  # held by every q_learning step and by checkpoints
+        self.executor = ThreadPoolExecutor(max_workers=max_games, thread_name_prefix='game')
+        self.playing = 0
+        self.games_played = 0
+        self.seats = set()  # of the players connected right now
+
+    def play(self, country_list):
+        # play_game, with the lock around the steps that update the shared Q-table
+        for current_turn in range(self.turns):
+            for nation in country_list:
+                nation.generate_money()
+                if nation.player:
+                    nation.competitor_info()
+                    nation.play_turn(current_turn, self.turns)
+                    continue
+
+                nation.find_perception()
+                if self.policy is not None:
+                    nation.play_greedy(current_turn)
+                else:
+                    with self.lock:
+                        nation.q_learning(current_turn)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        country_list = main.new_world(self.countries, self.policy or self.session.q_table, 'object')
+        player = country_list[self.seat]
+        player.player = True
+        player.seat = SocketSeat(loop, reader, writer)
+        self.seats.add(player.seat)
+        self.playing += 1
+        try:
+            player.seat.tell(f'You are player {player.name} of {self.countries}, for {self.turns} turns')
+            await loop.run_in_executor(self.executor, self.play, country_list)
+
+            reserves, _ = main.game_results(country_list)
+            rank = sum(reserve > player.reserve for reserve in reserves) + 1
+            writer.write(f'\nGAME OVER - Your reserve: {player.reserve} coins, rank {rank} of {self.countries}\n'.encode())
+            await writer.drain()
+            self.games_played += 1
+            if self.policy is None:
+                with self.lock:
+                    self.session.game_finished()
+        except ConnectionError:
+            pass  # the player left, their game is dropped
+        finally:
+            # Also when the server stops this task, so a game still waiting for the player ends too
+            player.seat.close()
+            self.seats.discard(player.seat)
+            self.playing -= 1
+            writer.close()
+
+    def close(self):
+        # Games waiting for their player end at once, the ones waiting for a thread are cancelled
+        for seat in list(self.seats):
+            seat.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def serve(server, host=SERVER_HOST, port=SERVER_PORT):
+    listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        try:
+            # Serves until cancelled (by Ctrl-C). Not listener.serve_forever(), which once cancelled waits for
+            # every connection to end, and so for players that are still in a game
+            await asyncio.get_running_loop().create_future()
+        finally:
+            server.close()
+
+
+def run_server(host=SERVER_HOST, port=SERVER_PORT, countries=main.COUNTRY_COUNT, turns=main.TURNS, learn=True):
+    # Serves games until interrupted. Play one with `python server.py connect` (or any line based client, like nc);
+    # what the AI countries learned is saved like in training
+    with main.TrainingSession(read_only=not learn, required=not learn) as session:
+        server = GameServer(session, countries, turns, learn=learn)
+        try:
+            asyncio.run(serve(server, host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+
+
+async def connect(host=SERVER_HOST, port=SERVER_PORT):
+    # Plays on a GameServer from this terminal: the server's lines are printed, typed lines are sent back
+    reader, writer = await asyncio.open_connection(host, port)
+    loop = asyncio.get_running_loop()
+
+    def send_typed_lines():
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(writer.write, line.encode())
+
+    # A daemon thread, as reading the terminal can't be interrupted when the game ends
+    threading.Thread(target=send_typed_lines, daemon=True).start()
+    while line := await reader.readline():
+        print(line.decode(errors='replace'), end='', flush=True)
+    writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hosts games of the AI countries for players on other terminals, '
+                                                 'or joins one.')
+    parser.add_argument('command', choices=('serve', 'connect'))
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--countries', type=int, default=main.COUNTRY_COUNT, help='countries of a served game')
+    parser.add_argument('--turns', type=int, default=main.TURNS, help='turns of a served game')
+    parser.add_argument('--frozen', action='store_true', help='play the saved Q-table without learning')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        run_server(SERVER_HOST, args.port, args.countries, args.turns, learn=not args.frozen)
+    else:
+        asyncio.run(connect(SERVER_HOST, args.port))
@@ -0,0 +1,42 @@
+import os
+import random
+import sys
+
+import pytest
+
+# The game is a script at the repository root, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+# Moves made on top of the AI turns, with random targets, so removals and blockades happen often
+RANDOM_MOVES = (
+    lambda country: country.purchase_connection(True),
+    lambda country: country.remove_connection(True),
+    lambda country: country.purchase_blockade(True),
+    lambda country: country.remove_blockade(True),
+    lambda country: country.defensive_block(),
+)
+
+
+@pytest.fixture
+def play_checked():
+    # Plays seeded AI turns (q_learning, with epsilon exploration) plus random moves on a small world, calling
+    # check(country_list) after every one of them
+    def play(check, seed, countries=8, turns=40, epsilon=0.3):
+        q_table = main.QTable()
+        q_table.epsilon = epsilon
+        country_list = main.new_world(countries, q_table, 'object', seed=seed)
+        moves = random.Random(seed)
+        for turn in range(turns):
+            for nation in country_list:
+                nation.generate_money()
+                nation.find_perception()
+                nation.q_learning(turn)
+                check(country_list)
+                for _ in range(moves.randint(0, 3)):
+                    moves.choice(RANDOM_MOVES)(moves.choice(country_list))
+                    check(country_list)
+        return country_list
+
+    return play
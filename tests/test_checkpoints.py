@@ -0,0 +1,41 @@
+import pytest
+
+import main
+
+
+def test_an_interrupted_run_saves_a_complete_table(tmp_path):
+    filename = str(tmp_path / 'q_table.bin')
+
+    def interrupt(record):
+        if record['game'] == 2:
+            raise KeyboardInterrupt
+
+    config = main.SimulationConfig(countries=5, turns=30, games=10, seed=1, q_table_file=filename, checkpoint_games=None,
+                                   checkpoint_seconds=None, verbosity=main.SILENT, stop_when=interrupt)
+    results = main.run_simulation(config)
+
+    assert results.interrupted and len(results.reserves) == 3
+    saved = main.load_q_table(filename)
+    assert saved.values == results.q_table.values and saved.present == results.q_table.present
+
+
+@pytest.mark.parametrize('filename', ['q_table.bin', 'q_table.json'])
+def test_a_failed_save_leaves_the_previous_table(filename, tmp_path, monkeypatch):
+    filename = str(tmp_path / filename)
+    previous = main.load_q_table(str(tmp_path / 'none.json'))
+    previous[(1, 1, 0, 1)] = [1.0] * previous.num_of_actions
+    main.save_q_table(previous, filename)
+
+    def write_half(table, target):
+        with open(target, 'w') as file:
+            file.write('{"(1, 1, 0, 1)": [2.0')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(main, 'write_q_table_binary', write_half)
+    monkeypatch.setattr(main, 'write_q_table_json', write_half)
+    newer = previous.copy()
+    newer[(2, 2, 1, 2)] = [3.0] * newer.num_of_actions
+    with pytest.raises(KeyboardInterrupt):
+        main.save_q_table(newer, filename)
+
+    assert main.load_q_table(filename).to_dict() == previous.to_dict()
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+import main
+
+pytest.importorskip('numpy')
+
+
+def train(engine, seed, epsilon, tmp_path):
+    config = main.SimulationConfig(countries=6, turns=60, games=2, engine=engine, seed=seed, epsilon=epsilon, save=False,
+                                   verbosity=main.SILENT, q_table_file=str(tmp_path / 'q_table.bin'))
+    results = main.run_simulation(config)
+    return results.reserves, results.incomes, results.q_table.values
+
+
+@pytest.mark.parametrize('seed, epsilon', [(0, 0.01), (1, 0.3), (2, 0.9)])
+def test_array_engine_plays_the_object_rules(seed, epsilon, tmp_path):
+    assert train('array', seed, epsilon, tmp_path) == train('object', seed, epsilon, tmp_path)
+
+
+def play_scripted_batch(seeds, countries, turns):
+    # Steps a BatchEnv with random actions, each repeated a random number of times up to its repeat_counts, and
+    # returns it with the (turn, country, action, times) of every step of each world and the actions that were
+    # repeated as runs of purchases (bulk) and as runs of no-ops
+    np = pytest.importorskip('numpy')
+    script = random.Random(0)
+    env = main.BatchEnv(len(seeds), countries, turns)
+    env.reset(seeds)
+    played = [[] for _ in seeds]
+    bulk, no_ops = set(), set()
+    while not env.done.all():
+        active = np.flatnonzero(~env.done)
+        actions = np.zeros(env.size, dtype=np.int64)
+        actions[active] = [script.choice(SCRIPTED_ACTIONS) for _ in active]
+        most = env.repeat_counts(active, actions[active])
+        times = np.ones(env.size, dtype=np.int64)
+        times[active] = np.minimum(most, [script.randint(1, 100) for _ in active])
+        for k, count in zip(active.tolist(), most.tolist()):
+            played[k].append((env.turn[k].item(), env.country[k].item(), actions[k].item(), times[k].item()))
+            if times[k] > 1:
+                (no_ops if count == env.NO_OP_REPEATS else bulk).add(actions[k].item())
+        env.step(actions, times)
+    return env, played, bulk, no_ops
+
+
+# Every action but do_nothing three times as likely, so turns are long enough for connections to max out
+SCRIPTED_ACTIONS = [action for action in range(len(main.ACTIONS)) for _ in range(1 if action == main.DO_NOTHING else 3)]
+
+
+def test_batch_env_plays_the_array_rules():
+    seeds, countries, turns = list(range(6)), 8, 40
+    env, played, bulk, no_ops = play_scripted_batch(seeds, countries, turns)
+    assert bulk == {main.PURCHASE_TOWN, main.PURCHASE_CONNECTION}
+    assert {main.PURCHASE_MINE, main.PURCHASE_TOWN, main.PURCHASE_CONNECTION, main.REMOVE_CONNECTION} <= no_ops
+
+    for seed, steps, batch_world in zip(seeds, played, env.worlds):
+        world = main.ArrayWorld(countries, rngs=main.random_streams(seed, countries))
+        steps = iter(steps)
+        for turn in range(turns):
+            for i in range(countries):
+                world.generate_money(i)
+                world.find_perception(i)
+                while world.can_afford_anything(i):
+                    step_turn, country, action, times = next(steps)
+                    assert (step_turn, country) == (turn, i)
+                    if action == main.DO_NOTHING:
+                        break
+                    for _ in range(times):
+                        if action == main.PURCHASE_MINE:
+                            world.purchase_mine(i, turn)
+                        else:
+                            getattr(world, main.ACTIONS[action])(i)
+                world.defensive_block(i)
+                world.find_power_level(i)
+        assert next(steps, None) is None
+
+        for name, _ in main.ArrayWorld.COUNTRY_ARRAYS + main.ArrayWorld.PAIR_ARRAYS:
+            assert getattr(world, name).tolist() == getattr(batch_world, name).tolist(), name
+        assert [rng.getstate() for rng in world.rngs] == [rng.getstate() for rng in batch_world.rngs]
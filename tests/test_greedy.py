@@ -0,0 +1,35 @@
+import random
+
+import pytest
+
+import main
+
+
+def rebuilt(table):
+    table = table.copy()
+    table.rebuild_greedy()
+    return list(table.greedy)
+
+
+@pytest.mark.parametrize('options', [dict(), dict(engine='array'), dict(experience=2000)])
+def test_learned_greedy_matches_a_rebuild(options, tmp_path):
+    if options.get('engine') == 'array' or options.get('experience'):
+        pytest.importorskip('numpy')
+    config = main.SimulationConfig(countries=6, turns=30, games=4, seed=3, epsilon=0.5, save=False,
+                                   q_table_file=str(tmp_path / 'q_table.bin'), verbosity=main.SILENT, **options)
+    table = main.run_simulation(config).q_table
+    assert any(table.present)
+    assert list(table.greedy) == rebuilt(table)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_learning_keeps_the_first_maximum_through_ties(seed):
+    # Few states and integer rewards with alpha 1 and gamma 0: values keep landing on each other, and drop below
+    # the greedy action's
+    rng = random.Random(seed)
+    table = main.QTable(num_of_actions=4, shape=(1, 1, 1, 6))
+    table.alpha, table.gamma = 1.0, 0.0
+    for _ in range(2000):
+        table.learn(rng.randrange(6), rng.randrange(4), rng.choice([-1, 0, 0, 1, 2]), rng.randrange(6))
+        assert list(table.greedy) == [table.find_greedy(index) for index in range(table.state_count)]
+    assert list(table.greedy) == rebuilt(table)
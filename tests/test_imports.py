@@ -0,0 +1,36 @@
+import pytest
+
+
+def scanned_imports(country_list, country):
+    # What the reverse index replaced: every country's connections scanned for the ones pointing at country
+    return {exporter.name: connection for exporter in country_list for connection in exporter.connections
+            if connection.importer == country.name}
+
+
+def check_imports(country_list):
+    for country in country_list:
+        scanned = scanned_imports(country_list, country)
+        assert country.imports.keys() == scanned.keys()
+        assert all(country.imports[exporter] is connection for exporter, connection in scanned.items())
+
+        incoming = [(country_list[exporter], connection) for exporter, connection in sorted(scanned.items())]
+        assert country.incoming_connections() == incoming
+        for blocked in (True, False):
+            assert country.incoming_connections(blocked) == [(exporter, connection) for exporter, connection in incoming
+                                                             if connection.blocked == blocked]
+
+        # the unblocked imports defensive_block counts
+        assert (sum(not connection.blocked for connection in country.imports.values())
+                == sum(not connection.blocked for connection in scanned.values()))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_imports_match_a_scan_of_every_connection(seed, play_checked):
+    blockades = []
+
+    def check(country_list):
+        check_imports(country_list)
+        blockades.append(sum(connection.blocked for country in country_list for connection in country.imports.values()))
+
+    play_checked(check, seed)
+    assert max(blockades) > 0
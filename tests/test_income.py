@@ -0,0 +1,29 @@
+import pytest
+
+import main
+
+# Every change to what an income depends on goes through one of these
+CHANGES = ('add_mines', 'add_towns', 'connect', 'drop_connection', 'block', 'unblock', 'find_power_level')
+
+
+def check_incomes(country_list):
+    for country in country_list:
+        assert country.generate_money(False) == country.compute_income()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_cached_income_matches_a_full_computation(seed, play_checked, monkeypatch):
+    checks = []
+
+    def checked(method):
+        def change(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            check_incomes(self.world)
+            checks.append(method.__name__)
+            return result
+        return change
+
+    for name in CHANGES:
+        monkeypatch.setattr(main.Countries, name, checked(getattr(main.Countries, name)))
+    play_checked(check_incomes, seed)
+    assert {'drop_connection', 'block', 'unblock'} <= set(checks)
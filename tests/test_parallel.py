@@ -0,0 +1,49 @@
+from array import array
+
+import main
+
+
+def train_parallel(seed, tmp_path):
+    config = main.SimulationConfig(countries=5, turns=30, games=6, workers=2, seed=seed, save=False,
+                                   q_table_file=str(tmp_path / 'q_table.bin'), verbosity=main.SILENT)
+    results = main.run_simulation(config)
+    return results.reserves, results.q_table.values
+
+
+def test_seeded_parallel_runs_are_reproducible(tmp_path):
+    first = train_parallel(7, tmp_path)
+    assert train_parallel(7, tmp_path) == first
+    assert train_parallel(8, tmp_path) != first
+
+
+def worker_table(snapshot, updates):
+    # A worker's table: the snapshot with {(state, action): (value, visits)} updates
+    table = snapshot.copy()
+    table.visits = array('q', bytes(8 * len(table.values)))
+    for (state, action), (value, visits) in updates.items():
+        row = table[state]
+        row[action] = value
+        table[state] = row
+        table.visits[main.state_index(state) * table.num_of_actions + action] = visits
+    return table
+
+
+def test_merge_averages_by_visits():
+    seen, shared, unseen = (1, 1, 0, 1), (2, 3, 1, 4), (3, 2, 2, 5)
+    snapshot = main.QTable()
+    snapshot[seen] = [1.0] * snapshot.num_of_actions
+    first = worker_table(snapshot, {(seen, 0): (4.0, 1), (shared, 2): (10.0, 3)})
+    second = worker_table(snapshot, {(seen, 0): (7.0, 2), (shared, 2): (2.0, 1), (shared, 5): (-1.0, 4)})
+
+    merged = main.merge_q_tables(snapshot, [first, second])
+
+    assert merged[seen] == [6.0] + [1.0] * (snapshot.num_of_actions - 1)  # (4 * 1 + 7 * 2) / 3
+    assert merged[shared][2] == 8.0  # (10 * 3 + 2 * 1) / 4
+    assert merged[shared][5] == -1.0
+    assert [value for action, value in enumerate(merged[shared]) if action not in (2, 5)] == [0.0] * (snapshot.num_of_actions - 2)
+    assert seen in merged and shared in merged and unseen not in merged
+    assert merged[unseen] == [0.0] * snapshot.num_of_actions
+    # the greedy actions are rebuilt from the merged values
+    assert merged.greedy[main.state_index(seen)] == 0 and merged.greedy[main.state_index(shared)] == 2
+    # the snapshot itself is left alone
+    assert snapshot[seen] == [1.0] * snapshot.num_of_actions and shared not in snapshot
@@ -0,0 +1,29 @@
+import os
+
+import main
+
+Q_TABLE_FILE = os.path.join(os.path.dirname(main.__file__), main.Q_TABLE_FILE)
+
+
+def profile_game(bulk_repeats, monkeypatch):
+    monkeypatch.setattr(main, 'BULK_REPEATS', bulk_repeats)
+    profiler = main.TurnProfiler()
+    profiler.enable()
+    try:
+        country_list = main.new_world(8, main.load_q_table(Q_TABLE_FILE), 'object', seed=1)
+        main.play_game(country_list)
+        profiler.game_finished()
+    finally:
+        profiler.disable()
+    return profiler.report()
+
+
+def test_execute_actions_histogram_counts_bulk_repeated_passes(monkeypatch):
+    bulk = profile_game(True, monkeypatch)
+    one_at_a_time = profile_game(False, monkeypatch)
+
+    assert bulk['execute_actions_passes'] == one_at_a_time['execute_actions_passes']
+    assert bulk['execute_actions_iterations'] == one_at_a_time['execute_actions_iterations']
+    # one pass at a time, every pass but the ones q_learning starts the turn with is a choose_action call
+    choices = one_at_a_time['phases']['choose_action']['calls'] - 8 * main.TURNS
+    assert one_at_a_time['execute_actions_passes'] == choices
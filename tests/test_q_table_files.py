@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import main
+
+Q_TABLE_JSON = os.path.join(os.path.dirname(main.__file__), 'q_table.json')
+
+
+def test_json_to_binary_to_json_keeps_every_value(tmp_path):
+    shipped = main.read_q_table_json(Q_TABLE_JSON)
+    binary = str(tmp_path / 'q_table.bin')
+    main.save_q_table(main.load_q_table(Q_TABLE_JSON), binary)
+    exported = str(tmp_path / 'q_table.json')
+    main.save_q_table(main.load_q_table(binary), exported)
+
+    assert main.read_q_table_json(exported) == shipped
+    table = main.load_q_table(binary)
+    assert list(table.greedy) == list(main.load_q_table(Q_TABLE_JSON).greedy)
+
+
+@pytest.mark.parametrize('cut', [1, 8, 1000])
+def test_truncated_binary_tables_are_rejected(cut, tmp_path):
+    binary = str(tmp_path / 'q_table.bin')
+    main.save_q_table(main.load_q_table(Q_TABLE_JSON), binary)
+    with open(binary, 'rb') as file:
+        data = file.read()
+    with open(binary, 'wb') as file:
+        file.write(data[:-cut])
+    with pytest.raises(ValueError):
+        main.load_q_table(binary)
+
+
+def test_a_missing_binary_table_falls_back_to_its_json_file(tmp_path):
+    main.save_q_table(main.load_q_table(Q_TABLE_JSON), str(tmp_path / 'q_table.json'))
+    table = main.load_q_table(str(tmp_path / 'q_table.bin'))
+    assert table.to_dict() == main.read_q_table_json(Q_TABLE_JSON)
+    assert main.q_table_exists(str(tmp_path / 'q_table.bin'))
+    assert len(main.load_q_table(str(tmp_path / 'other.bin'))) == 0
@@ -0,0 +1,36 @@
+import pytest
+
+import main
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ENGINES = ['object'] + (['array'] if numpy is not None else [])
+
+
+def world_state(country_list):
+    if isinstance(country_list, main.ArrayWorld):
+        return [(country_list.reserve[i].item(), country_list.towns[i].item(), country_list.markets[i].item(),
+                 country_list.mines[i].item(), country_list.power_level[i].item(), country_list.connections(i))
+                for i in range(country_list.count)]
+    return [(country.reserve, country.towns, country.markets, country.mines, country.power_level,
+             [[connection.importer, connection.level, connection.blocked] for connection in country.connections])
+            for country in country_list]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('replay_engine', ENGINES)
+def test_replays_end_in_the_played_worlds(engine, replay_engine, tmp_path):
+    filename = str(tmp_path / 'games.rpl')
+    played = []
+    with main.ReplayLog(filename) as log:
+        for seed in range(3):
+            q_table = main.QTable()
+            q_table.epsilon = 0.3
+            country_list = main.new_world(6, q_table, engine, seed=seed)
+            main.play_game(country_list, 40, log)
+            played.append(world_state(country_list))
+
+    assert [world_state(country_list) for country_list in main.replay(filename, replay_engine)] == played
@@ -0,0 +1,32 @@
+import pytest
+
+import main
+
+
+def formula_mine_budget(turn):
+    # The share purchase_mine spent before the rules were tabulated
+    return min((0.01 * (100 - turn) * 3), 1)
+
+
+def test_mine_budget_matches_its_formula():
+    for turn in range(250):
+        assert main.mine_budget(turn) == formula_mine_budget(turn)
+
+
+def test_batch_env_mine_purchases_match_the_formula():
+    np = pytest.importorskip('numpy')
+    turns = np.array([0, 1, 50, 66, 67, 99, 100, 101, 150, 300])
+    env = main.BatchEnv(len(turns), countries=2, turns=400)
+    env.reset(list(range(len(turns))))
+    worlds = np.arange(len(turns))
+    reserves = np.array([10 ** 6 + 7 * k for k in range(len(turns))], dtype=float)
+    env.turn[:] = turns
+    env.country[:] = 0
+    env.arrays['reserve'][:, 0] = reserves
+    env.arrays['mines'][:, 0] = 2
+
+    env.purchase_mine(worlds, np.ones(len(worlds), dtype=np.int64))
+    for k, turn in enumerate(turns.tolist()):
+        mines = reserves[k].item() * formula_mine_budget(turn) // 7
+        assert env.arrays['mines'][k, 0].item() == 2 + mines
+        assert env.arrays['reserve'][k, 0].item() == reserves[k].item() - mines * 7
@@ -0,0 +1,127 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+
+import main
+import server as game_server
+
+
+def test_server_stops_while_a_player_is_prompted(tmp_path):
+    session = main.TrainingSession(str(tmp_path / 'q_table.json'), read_only=True)
+    server = game_server.GameServer(session, countries=4, turns=3)
+    started = threading.Event()
+    running = {}
+
+    with socket.socket() as probe:
+        probe.bind((game_server.SERVER_HOST, 0))
+        port = probe.getsockname()[1]
+
+    async def serve():
+        running['loop'] = asyncio.get_running_loop()
+        running['task'] = asyncio.current_task()
+        started.set()
+        await game_server.serve(server, game_server.SERVER_HOST, port)
+
+    def run():
+        # Like run_server: the loop is stopped from outside (there by Ctrl-C), then the server is closed
+        try:
+            asyncio.run(serve())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            server.close()
+
+    server_thread = threading.Thread(target=run, daemon=True)
+    server_thread.start()
+    assert started.wait(5)
+
+    player = None
+    for _ in range(50):  # until the server listens
+        try:
+            player = socket.create_connection((game_server.SERVER_HOST, port), timeout=5)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    assert player is not None
+
+    with player:
+        received = b''
+        while b'choose an action' not in received:
+            received += player.recv(4096)
+        assert server.playing == 1
+
+        running['loop'].call_soon_threadsafe(running['task'].cancel)
+        server_thread.join(5)
+        assert not server_thread.is_alive()
+
+        # The game that was waiting for the player's answer has to end, or the interpreter never exits
+        games_ended = threading.Thread(target=server.executor.shutdown, daemon=True)
+        games_ended.start()
+        games_ended.join(5)
+        assert not games_ended.is_alive()
+
+
+class GameCounter:
+    # Stands in for the TrainingSession, without a q_table file or checkpoints
+    def __init__(self):
+        self.q_table = main.QTable()
+        self.finished = 0
+
+    def game_finished(self):
+        self.finished += 1
+
+
+async def play(port, rng, idle=None):
+    # A stand-in player making random moves, invalid ones included, until GAME OVER. With idle set it sits at its
+    # first action prompt until idle is set
+    reader, writer = await asyncio.open_connection(game_server.SERVER_HOST, port)
+    game_over = None
+    while line := await reader.readline():
+        text = line.decode()
+        if 'choose an action' in text:
+            if idle is not None:
+                await idle.wait()
+                idle = None
+            writer.write(f'{rng.choice([1, 2, 3, 4, 5, 6, 7, 7, 7, "x"])}\n'.encode())
+        elif 'Enter the index' in text or 'Choose a' in text or 'How many' in text:
+            writer.write(f'{rng.choice([1, 2, "x", -1])}\n'.encode())
+        elif 'GAME OVER' in text:
+            game_over = text
+    writer.close()
+    return game_over
+
+
+async def play_games(server, players, idle_player=False):
+    listener = await asyncio.start_server(server.handle, game_server.SERVER_HOST, 0)
+    port = listener.sockets[0].getsockname()[1]
+    idle = asyncio.Event()
+    idle_game = asyncio.create_task(play(port, random.Random(-1), idle)) if idle_player else None
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*(play(port, random.Random(i)) for i in range(players))), 60)
+        finished = server.session.finished
+        if idle_game is not None:
+            assert not idle_game.done()
+            idle.set()
+            results.append(await asyncio.wait_for(idle_game, 60))
+        return results, finished
+    finally:
+        listener.close()
+        server.close()
+
+
+def test_players_play_full_games():
+    server = game_server.GameServer(GameCounter(), countries=4, turns=3)
+    results, finished = asyncio.run(play_games(server, 3))
+    assert finished == 3
+    assert all(result is not None and result.startswith('GAME OVER') for result in results)
+    assert any(server.session.q_table.present)  # the AI countries learned
+
+
+def test_games_go_on_while_a_player_is_idle():
+    server = game_server.GameServer(GameCounter(), countries=4, turns=3)
+    results, finished = asyncio.run(play_games(server, 3, idle_player=True))
+    assert finished == 3  # every other game ended while one player sat at a prompt
+    assert server.session.finished == 4
+    assert all(result is not None and result.startswith('GAME OVER') for result in results)
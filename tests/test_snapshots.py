@@ -0,0 +1,50 @@
+import pytest
+
+import main
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ENGINES = ['object'] + (['array'] if numpy is not None else [])
+
+
+def world_state(country_list):
+    if isinstance(country_list, main.ArrayWorld):
+        return repr(country_list), country_list.perception.tolist()
+    return (repr(country_list), [country.perception for country in country_list],
+            [{exporter: (connection.importer, connection.level, connection.blocked)
+              for exporter, connection in country.imports.items()} for country in country_list])
+
+
+def use_q_table(country_list, q_table):
+    if isinstance(country_list, main.ArrayWorld):
+        country_list.q_table = q_table
+    else:
+        for country in country_list:
+            country.q_table = q_table
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('seed', [1, 2])
+def test_a_restored_snapshot_plays_on_the_same(engine, seed):
+    q_table = main.QTable()
+    q_table.epsilon = 0.05
+    country_list = main.new_world(8, q_table, engine, seed=seed)
+    main.play_game(country_list, 20)
+    snapshot = country_list.snapshot()
+    snapshot_q_table = q_table.copy()
+    snapshot_state = world_state(country_list)
+
+    main.play_game(country_list, 40, first_turn=20)
+    played = world_state(country_list)
+
+    country_list.restore(snapshot)
+    assert world_state(country_list) == snapshot_state
+    use_q_table(country_list, snapshot_q_table)
+    main.play_game(country_list, 40, first_turn=20)
+    assert world_state(country_list) == played
+
+    # a fork starts from the snapshot too
+    assert world_state(main.fork_world(snapshot, q_table, seed=5)) == snapshot_state
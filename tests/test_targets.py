@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+import main
+
+
+def scanned_targets(country_list, country):
+    # What the ranking replaced: every country scored by target_value, the ties for the best one above -1
+    values = {j: country.target_value(j) for j in range(len(country_list))}
+    values = {j: value for j, value in values.items() if value is not None}
+    best = max(values.values(), default=-1)
+    return [j for j, value in values.items() if value == best] if best > -1 else []
+
+
+def check_targets(country_list):
+    for country in country_list:
+        targets = country.best_targets()
+        scanned = scanned_targets(country_list, country)
+        assert list(targets) == scanned
+        assert [targets[position] for position in range(len(targets))] == scanned
+        with pytest.raises(IndexError):
+            targets[len(targets)]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_best_targets_match_a_scan_of_every_country(seed, play_checked):
+    tie_sizes = []
+
+    def check(country_list):
+        check_targets(country_list)
+        tie_sizes.extend(len(country.best_targets()) for country in country_list)
+
+    play_checked(check, seed, countries=12)
+    # both single best targets and ties were checked
+    assert 1 in tie_sizes and max(tie_sizes) > 2
+
+
+def test_best_targets_merge_related_and_ranked_importers():
+    # Every way a few importers can be related, ranked or excluded from the ranking, including all three at once
+    rng = random.Random(0)
+    for _ in range(5000):
+        countries = range(rng.randint(1, 10))
+        ranked = sorted(j for j in countries if rng.random() < 0.5)
+        excluded = {j for j in countries if rng.random() < 0.4}
+        skipped = sorted(excluded.intersection(ranked))
+        related = sorted(j for j in excluded if rng.random() < 0.7)
+        if len(skipped) == len(ranked):
+            ranked, skipped = [], []  # top_ranked never returns a rank without an importer left
+        targets = main.BestTargets(related, ranked, skipped)
+
+        expected = sorted(set(related).union(set(ranked).difference(skipped)))
+        assert len(targets) == len(expected)
+        assert list(targets) == expected
@@ -0,0 +1,72 @@
+import csv
+import os
+
+import pytest
+
+import main
+
+Q_TABLE_FILE = os.path.join(os.path.dirname(main.__file__), main.Q_TABLE_FILE)
+
+
+def play_with_telemetry(bulk_repeats, seed, monkeypatch):
+    monkeypatch.setattr(main, 'BULK_REPEATS', bulk_repeats)
+    q_table = main.load_q_table(Q_TABLE_FILE)
+    q_table.telemetry = main.StateTelemetry(q_table.state_count)
+    country_list = main.new_world(8, q_table, 'object', seed=seed)
+    main.play_game(country_list)
+    return q_table
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_bulk_repeats_count_every_visit(seed, monkeypatch):
+    bulk = play_with_telemetry(True, seed, monkeypatch)
+    one_at_a_time = play_with_telemetry(False, seed, monkeypatch)
+
+    assert bulk.values == one_at_a_time.values
+    assert bulk.telemetry.visits == one_at_a_time.telemetry.visits
+    assert bulk.telemetry.last_seen == one_at_a_time.telemetry.last_seen
+    assert (bulk.telemetry.hits, bulk.telemetry.misses) == (one_at_a_time.telemetry.hits, one_at_a_time.telemetry.misses)
+    assert bulk.telemetry.report(bulk) == one_at_a_time.telemetry.report(one_at_a_time)
+
+
+
+def test_batch_runs_count_every_pass(monkeypatch):
+    np = pytest.importorskip('numpy')
+    q_table = main.load_q_table(Q_TABLE_FILE)
+    q_table.telemetry = main.StateTelemetry(q_table.state_count)
+    env = main.BatchEnv(4, 8, 30)
+    passes = []
+    step = env.step
+
+    def counting_step(actions, times):
+        passes.append(int(times[np.flatnonzero(~env.done)].sum()))
+        return step(actions, times)
+
+    monkeypatch.setattr(env, 'step', counting_step)
+    main.play_batch(env, q_table, [1, 2, 3, 4])
+    telemetry = q_table.telemetry
+    assert sum(passes) > len(passes)  # runs of passes were played in one step
+    assert telemetry.hits + telemetry.misses == sum(telemetry.visits) == sum(passes)
+
+def test_bounded_runs_dont_depend_on_when_checkpoints_happen(tmp_path):
+    runs = []
+    for every_seconds in (0, None):
+        filename = str(tmp_path / f'q_table_{every_seconds}.bin')
+        config = main.SimulationConfig(countries=6, turns=60, games=6, seed=3, max_states=40, checkpoint_games=2,
+                                       checkpoint_seconds=every_seconds, q_table_file=filename, verbosity=main.SILENT)
+        results = main.run_simulation(config)
+        assert len(main.load_q_table(filename)) <= 40
+        assert results.telemetry['pruned_states'] > 0
+        runs.append((results.reserves, results.q_table.values))
+    assert runs[0] == runs[1]
+
+
+def test_csv_reports_have_the_hit_rate(tmp_path):
+    report_file = str(tmp_path / 'report.csv')
+    config = main.SimulationConfig(countries=4, turns=20, games=2, seed=1, telemetry=True, save=False,
+                                   q_table_file=str(tmp_path / 'q_table.bin'), verbosity=main.SILENT,
+                                   report_file=report_file)
+    main.run_simulation(config)
+    with open(report_file) as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == 2 and all(0 <= float(row['hit_rate']) <= 1 for row in rows)
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+import main
+import tournament
+
+Q_TABLE_FILE = os.path.join(os.path.dirname(main.__file__), 'q_table.json')
+
+
+def test_a_missing_entrant_file_is_an_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        tournament.run_tournament([Q_TABLE_FILE, str(tmp_path / 'q_tabel.json')], games=2, countries=4, turns=5,
+                                  workers=1, seed=0)
+
+
+def test_a_table_ties_with_itself():
+    report = tournament.run_tournament([Q_TABLE_FILE, Q_TABLE_FILE], games=6, countries=4, turns=30, workers=1, seed=0)
+
+    assert (report['games'], report['deals']) == (6, 3)
+    assert [standing['rating'] for standing in report['standings']] == [tournament.ELO_START] * 2
+    assert report['standings'][0]['reserve'] == report['standings'][1]['reserve']
+    pair, = report['pairs']
+    assert pair['wins'] == pair['losses'] == 0
+    _, low, high = pair['reserve_difference']
+    assert low <= 0 <= high
+
+
+def test_ratings_follow_the_deals():
+    report = tournament.run_tournament([Q_TABLE_FILE, 'rule_based'], games=8, countries=4, turns=30, workers=1, seed=1)
+
+    ratings = {standing['entrant']: standing['rating'] for standing in report['standings']}
+    assert sum(ratings.values()) == pytest.approx(2 * tournament.ELO_START)
+    pair, = report['pairs']
+    assert pair['wins'] + pair['losses'] <= report['deals'] == 4
+    if pair['wins'] != pair['losses']:
+        assert (ratings[Q_TABLE_FILE] > ratings['rule_based']) == (pair['wins'] > pair['losses'])
+    mean, low, high = pair['reserve_difference']
+    assert low <= mean <= high
+
+
+def test_interval():
+    assert tournament.interval([1.0, 1.0, 1.0]) == (1.0, 1.0, 1.0)
+    # standard deviation √2, over √2 values
+    assert tournament.interval([1.0, 3.0]) == pytest.approx((2.0, 2.0 - tournament.Z_95, 2.0 + tournament.Z_95))
+    assert tournament.expected_score(1500, 1500) == 0.5
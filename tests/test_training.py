@@ -0,0 +1,84 @@
+import csv
+import json
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('options', [dict(replay_file='games.rpl'), dict(profile=True), dict(profile_file='run.prof')])
+def test_batched_runs_refuse_what_they_cant_do(options, tmp_path):
+    config = main.SimulationConfig(games=4, batch=2, q_table_file=str(tmp_path / 'q_table.bin'),
+                                   verbosity=main.SILENT, **options)
+    with pytest.raises(ValueError):
+        main.run_simulation(config)
+
+
+@pytest.mark.parametrize('options', [dict(replay_file='games.rpl'), dict(profile=True), dict(profile_file='run.prof')])
+def test_parallel_runs_refuse_what_they_cant_do(options, tmp_path):
+    config = main.SimulationConfig(games=4, workers=2, q_table_file=str(tmp_path / 'q_table.bin'),
+                                   verbosity=main.SILENT, **options)
+    with pytest.raises(ValueError):
+        main.run_simulation(config)
+
+
+def test_evaluating_a_missing_table_is_an_error(tmp_path):
+    config = main.SimulationConfig(games=1, evaluate=True, q_table_file=str(tmp_path / 'does_not_exist.bin'),
+                                   verbosity=main.SILENT)
+    with pytest.raises(FileNotFoundError):
+        main.run_simulation(config)
+
+
+def test_a_required_table_may_be_the_json_fallback(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        main.TrainingSession(str(tmp_path / 'q_table.bin'), read_only=True, required=True)
+    main.write_q_table_json({(1, 1, 0, 1): [1.0] * len(main.ACTIONS)}, str(tmp_path / 'q_table.json'))
+    with main.TrainingSession(str(tmp_path / 'q_table.bin'), read_only=True, required=True) as session:
+        assert len(session.q_table) == 1
+
+
+@pytest.mark.parametrize('options, percents', [(dict(), [34, 67, 100]), (dict(evaluate=True), [34, 67, 100]),
+                                               (dict(batch=2), [67, 100])])
+def test_progress_counts_finished_games(options, percents, tmp_path, capsys):
+    q_table_file = str(tmp_path / 'q_table.bin')
+    if options.get('evaluate'):
+        main.save_q_table(main.QTable(), q_table_file)
+    config = main.SimulationConfig(countries=4, turns=3, games=3, seed=1, save=False, q_table_file=q_table_file,
+                                   verbosity=main.PROGRESS, **options)
+    main.run_simulation(config)
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith('Training ')]
+    assert lines == [f'Training {percent}% complete' for percent in percents]
+
+
+def test_stop_when_ends_the_run_early(tmp_path):
+    config = main.SimulationConfig(countries=4, turns=3, games=10, seed=1, save=False, verbosity=main.SILENT,
+                                   q_table_file=str(tmp_path / 'q_table.bin'),
+                                   stop_when=lambda record: record['game'] == 3)
+    results = main.Results(config)
+    records = list(main.train(config, results))
+    assert [record['game'] for record in records] == [0, 1, 2, 3]
+    assert results.stopped and not results.interrupted
+    assert len(results.reserves) == 4
+
+
+@pytest.mark.parametrize('every', [1, 2])
+def test_report_files(every, tmp_path):
+    csv_file, json_file = str(tmp_path / 'report.csv'), str(tmp_path / 'report.jsonl')
+    for report_file in (csv_file, json_file):
+        config = main.SimulationConfig(countries=4, turns=3, games=5, seed=1, save=False, verbosity=main.SILENT,
+                                       q_table_file=str(tmp_path / 'q_table.bin'), report_file=report_file,
+                                       report_every=every)
+        main.run_simulation(config)
+    reported = list(range(0, 5, every))
+
+    with open(csv_file) as file:
+        assert next(csv.reader(file)) == list(main.Reporter.CSV_FIELDS)
+        file.seek(0)
+        rows = list(csv.DictReader(file))
+    assert [int(row['game']) for row in rows] == reported
+
+    with open(json_file) as file:
+        records = [json.loads(line) for line in file]
+    assert [record['game'] for record in records] == reported
+    fields = set(main.Reporter.CSV_FIELDS) - {'hit_rate'}  # hit_rate only with telemetry
+    assert all(fields <= set(record) for record in records)
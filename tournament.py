@@ -0,0 +1,155 @@
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import statistics
+
+import main
+
+ELO_START = 1500
+ELO_K = 16  # rating points at stake in each comparison of two entrants
+Z_95 = 1.96  # confidence intervals are mean ± Z_95 standard errors
+
+worker_world = None  # world a play_matchup process reuses from one game to the next
+
+
+def load_entrant(source):
+    # 'rule_based', or the file of a Q-table, played frozen as a GreedyPolicy
+    if source == 'rule_based':
+        return main.RuleBased()
+    if not main.q_table_exists(source):
+        raise FileNotFoundError(f'No Q-table in {source}')
+    return main.GreedyPolicy(main.load_q_table(source))
+
+
+def play_matchup(task):
+    # One game of a mixed country_list: country i plays policies[seats[i]]. Returns (reserves, incomes)
+    global worker_world
+    policies, seats, seed, turns = task
+    worker_world = main.new_world(len(seats), None, 'object', reuse=worker_world, seed=seed)
+    for country, entrant in zip(worker_world, seats):
+        country.q_table = policies[entrant]
+    main.play_game(worker_world, turns, evaluate=True)
+    return main.game_results(worker_world)
+
+
+def interval(values):
+    # (mean, low, high) of a 95% confidence interval for the mean of values
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, -math.inf, math.inf
+    error = Z_95 * statistics.stdev(values) / math.sqrt(len(values))
+    return mean, mean - error, mean + error
+
+
+def expected_score(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def run_tournament(sources, games=100, countries=main.COUNTRY_COUNT, turns=main.TURNS, workers=main.WORKERS,
+                   seed=main.SEED):
+    # Plays games of countries seats shared round-robin between the entrants, in a pool of workers processes. The
+    # games are dealt in duplicate: every deal (a seed and a random seat order, as the turn order matters) is played
+    # once per rotation of the entrants over the seats, so each of them plays every seat of it. games is rounded up to
+    # a whole number of deals. Every deal, each entrant scores its average reserve and income over its seats and
+    # games; the ones with the better reserve beat the others for the Elo ratings, which are updated deal by deal
+    names = []
+    for source in sources:
+        name, copies = source, 1
+        while name in names:
+            copies += 1
+            name = f'{source} #{copies}'
+        names.append(name)
+    if not 2 <= len(names) <= countries:
+        raise ValueError(f'A tournament needs between 2 and {countries} entrants')
+
+    policies = [load_entrant(source) for source in sources]
+    master = random.Random(seed)
+    deals = math.ceil(games / len(names))
+    tasks = []
+    for _ in range(deals):
+        order = list(range(len(names)))
+        master.shuffle(order)
+        deal_seed = master.getrandbits(64)
+        for rotation in range(len(names)):
+            rotated = order[rotation:] + order[:rotation]
+            tasks.append((policies, [rotated[i % len(rotated)] for i in range(countries)], deal_seed, turns))
+
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            game_results = pool.map(play_matchup, tasks)  # in task order, so the ratings don't depend on timing
+    else:
+        game_results = [play_matchup(task) for task in tasks]
+
+    ratings = [ELO_START] * len(names)
+    reserves = [[] for _ in names]  # average reserve of each entrant's seats, one per deal
+    incomes = [[] for _ in names]
+    for deal in range(deals):
+        deal_games = range(deal * len(names), (deal + 1) * len(names))
+        for entrant in range(len(names)):
+            deal_reserves, deal_incomes = [], []
+            for game in deal_games:
+                own_seats = [i for i, seat in enumerate(tasks[game][1]) if seat == entrant]
+                game_reserves, game_incomes = game_results[game]
+                deal_reserves.append(statistics.fmean(game_reserves[i] for i in own_seats))
+                deal_incomes.append(statistics.fmean(game_incomes[i] for i in own_seats))
+            reserves[entrant].append(statistics.fmean(deal_reserves))
+            incomes[entrant].append(statistics.fmean(deal_incomes))
+
+        changes = [0.0] * len(names)
+        for a in range(len(names)):
+            for b in range(len(names)):
+                if a != b:
+                    score = 1 if reserves[a][-1] > reserves[b][-1] else 0.5 if reserves[a][-1] == reserves[b][-1] else 0
+                    changes[a] += ELO_K * (score - expected_score(ratings[a], ratings[b]))
+        ratings = [rating + change for rating, change in zip(ratings, changes)]
+
+    standings = sorted(({'entrant': name, 'rating': ratings[a], 'reserve': interval(reserves[a]),
+                         'income': interval(incomes[a])} for a, name in enumerate(names)),
+                       key=lambda standing: -standing['rating'])
+    # The deals are the same for both entrants of a pair, so their differences are compared deal by deal. An interval
+    # without 0 means one of them is better with 95% confidence
+    pairs = []
+    for a in range(len(names)):
+        for b in range(a + 1, len(names)):
+            pairs.append({
+                'entrants': [names[a], names[b]],
+                'wins': sum(x > y for x, y in zip(reserves[a], reserves[b])),
+                'losses': sum(x < y for x, y in zip(reserves[a], reserves[b])),
+                'reserve_difference': interval([x - y for x, y in zip(reserves[a], reserves[b])]),
+                'income_difference': interval([x - y for x, y in zip(incomes[a], incomes[b])]),
+            })
+    return {'games': len(tasks), 'deals': deals, 'countries': countries, 'turns': turns, 'standings': standings,
+            'pairs': pairs}
+
+
+def describe_tournament(report):
+    lines = [f"{report['games']} games ({report['deals']} deals) of {report['countries']} countries, {report['turns']} turns"]
+    for standing in report['standings']:
+        reserve, income = standing['reserve'], standing['income']
+        lines.append(f"{standing['rating']:7.1f}  {standing['entrant']}: reserve {reserve[0]:.4g} "
+                     f"({reserve[1]:.4g} to {reserve[2]:.4g}), income {income[0]:.4g} ({income[1]:.4g} to {income[2]:.4g})")
+    for pair in report['pairs']:
+        low, high = pair['reserve_difference'][1:]
+        verdict = 'no significant difference' if low <= 0 <= high else f'{pair["entrants"][0 if low > 0 else 1]} is better'
+        lines.append(f"{pair['entrants'][0]} vs {pair['entrants'][1]}: {pair['wins']} deals won, {pair['losses']} lost, "
+                     f"{verdict}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plays Q-tables and the rule based strategy against each other in '
+                                                 'mixed games and rates them.')
+    parser.add_argument('entrants', nargs='+', help="Q-table files (.bin or .json: q_table.bin once trained, the "
+                                                       "shipped q_table.json), or 'rule_based'")
+    parser.add_argument('--games', type=int, default=100, help='games to play, rounded up to whole deals')
+    parser.add_argument('--countries', type=int, default=main.COUNTRY_COUNT)
+    parser.add_argument('--turns', type=int, default=main.TURNS)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    tournament = run_tournament(args.entrants, args.games, args.countries, args.turns, args.workers, args.seed)
+    print(json.dumps(tournament) if args.json else describe_tournament(tournament))